@@ -5,7 +5,7 @@ from .export.image import ImageExporter
 # Have to import everything with classes which need to be registered
 from . import engine, nodes, operators, properties, ui
 from .nodes import materials, volumes, textures
-from .ui import config, errorlog, halt, light, material, world
+from .ui import config, errorlog, halt, light, material, performance, world
 
 bl_info = {
     "name": "LuxCore",
@@ -5,6 +5,12 @@ from ..draw import FrameBuffer, FrameBufferFinal
 from .. import export
 from ..utils import render as utils_render
 
+# A new engine instance is created for each frame of an animation render.
+# This dict keeps the exporters (and with them the LuxCore scenes) alive between
+# the frames, so static geometry is only exported once per animation.
+# Maps scene name -> Exporter
+_animation_exporters = {}
+
 
 class LuxCoreRenderEngine(bpy.types.RenderEngine):
     bl_idname = "LUXCORE"
@@ -33,12 +39,40 @@ class LuxCoreRenderEngine(bpy.types.RenderEngine):
             assert self._session is None
             self.update_stats("Export", "exporting...")
             start = time()
-            self._session = self._exporter.create_session(scene)
+
+            if self.is_animation and scene.luxcore.performance.reuse_scene_in_animation:
+                self._session = self._create_animation_session(scene)
+            else:
+                self._session = self._exporter.create_session(scene, engine=self)
+
             print("Export took %.1fs" % (time() - start))
+        except export.ExportCancelled as error:
+            # Nothing to render, self.render() returns immediately
+            print(error)
         except Exception as error:
             # Will be reported in self.render() below
             self.error = error
 
+    def _create_animation_session(self, scene):
+        exporter = _animation_exporters.get(scene.name)
+        is_next_frame = (exporter is not None and exporter.animation_frame is not None
+                         and scene.frame_current == exporter.animation_frame + scene.frame_step)
+
+        if is_next_frame:
+            self._exporter = exporter
+            return exporter.create_session_for_next_frame(scene, engine=self)
+
+        # First frame of a new animation
+        _animation_exporters[scene.name] = self._exporter
+        return self._exporter.create_session(scene, engine=self)
+
+    def _end_animation(self, scene, cancelled):
+        if not self.is_animation:
+            return
+        is_last_frame = scene.frame_current + scene.frame_step > scene.frame_end
+        if cancelled or is_last_frame:
+            _animation_exporters.pop(scene.name, None)
+
     def render(self, scene):
         try:
             # Clear error log
@@ -47,6 +81,11 @@ class LuxCoreRenderEngine(bpy.types.RenderEngine):
             if self.error:
                 raise self.error
 
+            if self._session is None and self.test_break():
+                # Export was cancelled
+                self._end_animation(scene, cancelled=True)
+                return
+
             assert self._session is not None
             self.update_stats("Render", "rendering...")
             self._framebuffer = FrameBufferFinal(scene)
@@ -68,12 +107,15 @@ class LuxCoreRenderEngine(bpy.types.RenderEngine):
                     self._framebuffer.draw(self, self._session)
                     last_refresh = now
 
+            cancelled = self.test_break()
             self._session.Stop()
             self._framebuffer.draw(self, self._session)
             del self._session
+            self._end_animation(scene, cancelled)
         except Exception as error:
             del self._session
             self._session = None
+            self._end_animation(scene, cancelled=True)
 
             self.report({"ERROR"}, str(error))
             self.error_set(str(error))
@@ -127,6 +169,13 @@ class LuxCoreRenderEngine(bpy.types.RenderEngine):
                 # Only update allowed in view_draw if it is a camera update, for everything else we call view_update_lux()
                 # We have to re-assign the session because it might have been replaced due to filmsize change
                 self._session = self._exporter.update(context, self._session, export.Change.CAMERA)
+            elif self._exporter.pending_objects:
+                self._exporter.stream_pending_objects(context, self._session)
+                pending_count = len(self._exporter.pending_objects)
+                self.update_stats("Viewport Render", "Exporting objects: %d left" % pending_count if pending_count else "")
+            elif self._exporter.has_idle_proxies():
+                # The viewport did not change for a while, show the full resolution meshes
+                self._exporter.replace_proxies(context, self._session)
 
             if self._framebuffer is None:
                 self._framebuffer = FrameBuffer(context)
@@ -1,9 +1,22 @@
 import bpy
+from collections import deque
+from time import time
 from ..bin import pyluxcore
 from .. import utils
-from . import blender_object, camera, config, light, material
+from . import animation, blender_object, camera, config, light, material, mesh, streaming
+from .chunked_parse import ChunkedParser
+from .geometry_cache import GeometryCache, default_directory
+from .image import ImageExporter
+from .instancing import InstancingPolicy
 from .light import WORLD_BACKGROUND_LIGHT_NAME
-from ..nodes.output import get_active_output
+from .lod import ViewportLod, IDLE_TIME
+from .material_index import MaterialIndex
+from .mesh_cache import MeshCache
+from .parked import ParkedObjects
+from .progress import ExportProgress, ExportCancelled, NEXT_FRAME_PHASES
+from .property_diff import PropertyDiff
+from ..nodes import with_export_memo
+from ..nodes.template import clear_templates
 
 
 class Change:
@@ -72,34 +85,45 @@ class ObjectCache(object):
 
 
 class MaterialCache(object):
-    def __init__(self):
+    def __init__(self, material_index):
+        self.material_index = material_index
         self._reset()
 
     def _reset(self):
         self.changed_materials = []
+        self.changed_volumes = []
 
     def diff(self):
+        self._reset()
+
         if bpy.data.materials.is_updated:
-            for mat in bpy.data.materials:
-                node_tree = mat.luxcore.node_tree
-                mat_updated = False
-
-                if node_tree:
-                    if node_tree.is_updated or node_tree.is_updated_data:
-                        mat_updated = True
-
-                    # Check linked volumes for changes
-                    active_output = get_active_output(node_tree, "LuxCoreNodeMatOutput")
-                    interior_vol = active_output.interior_volume
-                    if interior_vol and (interior_vol.is_updated or interior_vol.is_updated_data):
-                        mat_updated = True
-                    exterior_vol = active_output.exterior_volume
-                    if exterior_vol and (exterior_vol.is_updated or exterior_vol.is_updated_data):
-                        mat_updated = True
-                else:
-                    mat_updated = mat.is_updated
+            index = self.material_index
+            index.update()
+            changed_keys = set()
 
-                if mat_updated:
+            # Materials that changed themselves, e.g. a node tree was (re-)assigned
+            for mat in bpy.data.materials:
+                if mat.is_updated:
+                    index.update_material(mat)
+                    changed_keys.add(utils.make_key(mat))
+
+            changed_trees = [node_tree for node_tree in bpy.data.node_groups
+                             if node_tree.is_updated or node_tree.is_updated_data]
+
+            # Volumes might have been (un)assigned in the output node, update the index before it is used below
+            for node_tree in changed_trees:
+                if node_tree.bl_idname == "luxcore_material_nodes":
+                    index.update_tree(node_tree)
+
+            # Node trees (material and volume) that changed, and the materials using them
+            for node_tree in changed_trees:
+                changed_keys |= index.materials_using_tree(node_tree)
+                if node_tree.bl_idname == "luxcore_volume_nodes":
+                    self.changed_volumes.append(node_tree)
+
+            for key in changed_keys:
+                mat = index.get_material(key)
+                if mat:
                     self.changed_materials.append(mat)
 
         return self.changed_materials
@@ -152,45 +176,243 @@ class Exporter(object):
         self.config_cache = StringCache()
         self.camera_cache = StringCache()
         self.object_cache = ObjectCache()
-        self.material_cache = MaterialCache()
+        # Node tree -> materials -> objects, used for change detection and material export
+        self.material_index = MaterialIndex()
+        self.material_cache = MaterialCache(self.material_index)
         self.visibility_cache = VisibilityCache()
         self.world_cache = WorldCache()
+        # Shapes defined in the luxcore_scene, re-used if the mesh did not change
+        # and shared between objects with the same mesh datablock/modifier combination
+        self.mesh_cache = MeshCache()
+        # Materials defined in the luxcore_scene, so shared materials are only converted once
+        self.exported_materials = material.ConversionCache(self.material_index)
+        # Last definitions sent in viewport scene edits, unchanged entities are not parsed again
+        self.property_diff = PropertyDiff()
         # This dict contains ExportedObject and ExportedLight instances
         self.exported_objects = {}
-
-    def create_session(self, scene, context=None):
+        # Objects hidden during viewport render, their shapes are kept for unhiding
+        self.parked_objects = None
+        # Decimated proxies of heavy meshes in viewport render, None if disabled
+        self.lod = None
+        # Bake-vs-instance decision of final renders, None in viewport render
+        self.instancing = None
+        self.last_change_time = time()
+        # Keys of visible objects that are not exported yet (progressive viewport export)
+        self.pending_objects = deque()
+
+        # Only used in animation renders where the scene is re-used for multiple frames
+        self._luxcore_scene = None
+        self.animated = None
+        self.animation_frame = None
+
+    @with_export_memo
+    def create_session(self, scene, context=None, engine=None):
+        """
+        Export the scene in phases (camera, objects, lights, world, config).
+        If an engine is passed (final render), the progress is reported to it and the export
+        stops with ExportCancelled when the user cancels.
+        """
         print("create_session")
+        progress = ExportProgress(engine)
+        # Templates of the last session might belong to removed node trees
+        clear_templates()
+        # This might not be the first session of this exporter (e.g. the viewport render is restarted after
+        # an error), the materials and volumes defined in the old luxcore_scene don't exist in the new one
+        self.exported_materials = material.ConversionCache(self.material_index)
+        self.property_diff = PropertyDiff()
         # Scene
         luxcore_scene = pyluxcore.Scene()
-        scene_props = pyluxcore.Properties()
 
         # Camera (needs to be parsed first because it is needed for hair tesselation)
+        progress.start_phase("Camera")
         camera_props = camera.convert(scene, context)
         self.camera_cache.diff(camera_props)  # Init camera cache
         luxcore_scene.Parse(camera_props)
+        progress.step()
 
         # Objects and lamps
         objs = context.visible_objects if context else bpy.data.objects
-
-        for obj in objs:
-            if obj.type in ("MESH", "CURVE", "SURFACE", "META", "FONT", "LAMP"):
-                self._convert_object(scene_props, obj, scene, context, luxcore_scene)
+        lamps = [obj for obj in objs if obj.type == "LAMP"]
+        objs = [obj for obj in objs if obj.type in ("MESH", "CURVE", "SURFACE", "META", "FONT")]
+
+        performance = scene.luxcore.performance
+        if context and performance.use_viewport_lod:
+            self.lod = ViewportLod(performance.viewport_lod_triangles)
+
+        definition_pool = None
+        if performance.mesh_export_mode == "BUFFERS" and performance.definition_threads > 0:
+            # Meshes are extracted on this thread and defined by the worker threads of the pool
+            definition_pool = mesh.DefinitionPool(luxcore_scene, performance.definition_threads)
+
+        if performance.use_chunked_parse:
+            # Parse the definitions while exporting instead of keeping all of them in memory
+            scene_props = ChunkedParser(luxcore_scene, performance.parse_chunk_size, definition_pool)
+        else:
+            scene_props = pyluxcore.Properties()
+
+        geometry_cache = None
+        if performance.use_geometry_cache and not context:
+            # Only for final renders, viewport edits would fill the cache with outdated meshes
+            directory = bpy.path.abspath(performance.geometry_cache_dir) or default_directory()
+            geometry_cache = GeometryCache(directory, performance.geometry_cache_size * 1024 * 1024)
+
+        if not context:
+            self.instancing = InstancingPolicy(scene, objs, performance.instancing_threshold)
+            # Materials are updated between the frames if the scene is re-used in an animation
+            reused = engine and engine.is_animation and performance.reuse_scene_in_animation
+            self.exported_materials.deduplicate = performance.deduplicate_materials and not reused
+
+        deadline = None
+        if context and performance.use_progressive_export:
+            # Start rendering after the first batch, the other objects are streamed in by view_draw()
+            objs = streaming.sort_by_priority(objs, context)
+            deadline = time() + performance.progressive_batch_time / 1000
+
+        progress.start_phase("Objects", len(objs))
+        try:
+            for index, obj in enumerate(objs):
+                if deadline and time() > deadline:
+                    self.pending_objects = deque(utils.make_key(pending_obj) for pending_obj in objs[index:])
+                    print("Progressive export: %d objects pending" % len(self.pending_objects))
+                    break
+
+                exported = self._convert_object(scene_props, obj, scene, context, luxcore_scene,
+                                                definition_pool, geometry_cache)
+                progress.step(exported)
+        except ExportCancelled:
+            if definition_pool:
+                definition_pool.cancel()
+            raise
+
+        if definition_pool:
+            # All shapes have to be defined before the objects referencing them are parsed
+            definition_pool.finish()
+            if not performance.use_chunked_parse:
+                # The ChunkedParser does this itself
+                scene_props = definition_pool.filter_failed(scene_props)
+
+        if geometry_cache:
+            print("Geometry cache: %d hits, %d misses" % (geometry_cache.hits, geometry_cache.misses))
+
+        # Lamps
+        progress.start_phase("Lights", len(lamps))
+        for obj in lamps:
+            exported = self._convert_object(scene_props, obj, scene, context, luxcore_scene)
+            progress.step(exported)
 
         # World
+        progress.start_phase("World")
         if scene.world and scene.world.luxcore.light != "none":
             props = light.convert_world(scene.world, scene)
             scene_props.Set(props)
+            progress.step()
 
-        luxcore_scene.Parse(scene_props)
+        if performance.use_chunked_parse:
+            scene_props.flush()
+            scene_props.print_stats()
+        else:
+            luxcore_scene.Parse(scene_props)
+
+        if definition_pool and definition_pool.skipped_objects:
+            # Like objects that fail during a synchronous conversion, they are not exported
+            self._forget_skipped_objects(definition_pool.skipped_objects)
 
         # Convert config at last because all lightgroups and passes have to be already defined
+        progress.start_phase("Config")
         config_props = config.convert(scene, context)
         self.config_cache.diff(config_props)  # Init config cache
         renderconfig = pyluxcore.RenderConfig(config_props, luxcore_scene)
+        progress.step()
+        progress.finish()
+        print("Mesh cache: %d hits, %d misses" % (self.mesh_cache.hits, self.mesh_cache.misses))
+        print("Material cache: %d hits, %d misses, %d deduplicated"
+              % (self.exported_materials.hits, self.exported_materials.misses, self.exported_materials.deduplicated))
+        ImageExporter.print_stats()
+        if self.instancing:
+            self.instancing.print_stats()
+
+        if context:
+            self.parked_objects = ParkedObjects(performance.parked_memory_limit * 1024 * 1024)
+        else:
+            # Keep the scene so it can be re-used for the next frame of an animation
+            self._luxcore_scene = luxcore_scene
+            self.animation_frame = scene.frame_current
 
         # Session
         return pyluxcore.RenderSession(renderconfig)
 
+    @with_export_memo
+    def create_session_for_next_frame(self, scene, engine=None):
+        """
+        Used in animation renders, after create_session() was called for the first frame.
+        Re-uses the luxcore_scene of the last frame and only updates the things that are animated.
+        The session of the last frame has to be stopped already.
+        """
+        print("create_session_for_next_frame")
+        assert self._luxcore_scene is not None
+        progress = ExportProgress(engine, NEXT_FRAME_PHASES)
+        luxcore_scene = self._luxcore_scene
+        objs = bpy.data.objects
+
+        if self.animated is None:
+            # Only needs to be done once per animation
+            self.animated = animation.find_animated(scene, objs)
+            print("Animated:", self.animated)
+
+        # Camera (needs to be parsed first because it is needed for hair tesselation)
+        progress.start_phase("Camera")
+        camera_props = camera.convert(scene)
+        if self.camera_cache.diff(camera_props):
+            luxcore_scene.Parse(camera_props)
+        progress.step()
+
+        props = pyluxcore.Properties()
+
+        animated_objs = [obj for obj in objs if utils.make_key(obj) in self.animated.objects
+                         and obj.type in ("MESH", "CURVE", "SURFACE", "META", "FONT", "LAMP")]
+        progress.start_phase("Objects", len(animated_objs))
+
+        for obj in animated_objs:
+            if utils.is_obj_visible(obj, scene):
+                exported = self._convert_object(props, obj, scene, None, luxcore_scene)
+            else:
+                # Visibility can be animated, too
+                self._remove_exported(utils.make_key(obj), luxcore_scene)
+                exported = False
+            progress.step(exported)
+
+        animated_mats = [mat for mat in bpy.data.materials if utils.make_key(mat) in self.animated.materials]
+        progress.start_phase("Materials", len(animated_mats))
+
+        for node_tree in bpy.data.node_groups:
+            if utils.make_key(node_tree) in self.animated.volumes:
+                self.exported_materials.discard_volume(node_tree)
+
+        for mat in animated_mats:
+            self.exported_materials.update(mat, props)
+            progress.step()
+
+        progress.start_phase("World")
+        if self.animated.world and scene.world:
+            if scene.world.luxcore.light == "none":
+                luxcore_scene.DeleteLight(WORLD_BACKGROUND_LIGHT_NAME)
+            else:
+                props.Set(light.convert_world(scene.world, scene))
+            progress.step()
+
+        luxcore_scene.Parse(props)
+        print("Mesh cache: %d hits, %d misses" % (self.mesh_cache.hits, self.mesh_cache.misses))
+
+        progress.start_phase("Config")
+        config_props = config.convert(scene)
+        self.config_cache.diff(config_props)
+        renderconfig = pyluxcore.RenderConfig(config_props, luxcore_scene)
+        self.animation_frame = scene.frame_current
+        progress.step()
+        progress.finish()
+
+        return pyluxcore.RenderSession(renderconfig)
+
     def get_changes(self, context):
         changes = Change.NONE
 
@@ -204,6 +426,9 @@ class Exporter(object):
 
         if self.object_cache.diff(context.scene):
             changes |= Change.OBJECT
+            if self.object_cache.changed_mesh:
+                # Material slots might have been re-assigned
+                self.material_index.update_objects(self.object_cache.changed_mesh)
 
         if self.material_cache.diff():
             changes |= Change.MATERIAL
@@ -216,18 +441,28 @@ class Exporter(object):
 
         return changes
 
+    @with_export_memo
     def update(self, context, session, changes):
         if changes & Change.CONFIG:
             # We already converted the new config settings during get_changes(), re-use them
             session = self._update_config(session, self.config_cache.props)
 
+        if changes:
+            self.last_change_time = time()
+
         if changes & Change.REQUIRES_SCENE_EDIT:
             luxcore_scene = session.GetRenderConfig().GetScene()
             session.BeginSceneEdit()
 
             try:
                 props = self._scene_edit(context, changes, luxcore_scene)
-                luxcore_scene.Parse(props)
+                luxcore_scene.Parse(self.property_diff.filter(props))
+                self.property_diff.print_stats()
+
+                if changes & Change.VISIBILITY:
+                    # Only after the Parse, otherwise the shapes of the objects that were
+                    # just defined or unparked are not referenced yet and would be removed
+                    self.parked_objects.enforce_limit(luxcore_scene, self.mesh_cache)
             except Exception as error:
                 print("Error in update():", error)
                 import traceback
@@ -241,17 +476,133 @@ class Exporter(object):
         # because it might have been replaced in _update_config()
         return session
 
-    def _convert_object(self, props, obj, scene, context, luxcore_scene):
+    @with_export_memo
+    def stream_pending_objects(self, context, session):
+        """
+        Export the next batch of pending objects in one scene edit.
+        The batch is limited by the time budget of the progressive export.
+        """
+        luxcore_scene = session.GetRenderConfig().GetScene()
+        deadline = time() + context.scene.luxcore.performance.progressive_batch_time / 1000
+        session.BeginSceneEdit()
+
+        try:
+            props = pyluxcore.Properties()
+            visible_objects = {utils.make_key(obj): obj for obj in context.visible_objects}
+
+            # Export at least one object per batch
+            while self.pending_objects:
+                key = self.pending_objects.popleft()
+                obj = visible_objects.get(key)
+
+                # The object might have been hidden, or already exported because it changed
+                if obj and key not in self.exported_objects:
+                    self._convert_object(props, obj, context.scene, context, luxcore_scene)
+
+                if time() > deadline:
+                    break
+
+            luxcore_scene.Parse(self.property_diff.filter(props))
+        except Exception as error:
+            print("Error in stream_pending_objects():", error)
+            import traceback
+            traceback.print_exc()
+        finally:
+            session.EndSceneEdit()
+
+    def has_idle_proxies(self):
+        """ True if viewport proxies are shown and the viewport did not change for a while """
+        if self.lod is None or time() - self.last_change_time < IDLE_TIME:
+            return False
+        return any(getattr(exported_obj, "is_proxy", False) for exported_obj in self.exported_objects.values())
+
+    @with_export_memo
+    def replace_proxies(self, context, session):
+        """ Replace the viewport proxies by the full resolution meshes in one scene edit """
+        print("replacing viewport proxies")
+        luxcore_scene = session.GetRenderConfig().GetScene()
+        session.BeginSceneEdit()
+
+        try:
+            props = pyluxcore.Properties()
+            proxy_keys = [key for key, exported_obj in self.exported_objects.items()
+                          if getattr(exported_obj, "is_proxy", False)]
+            visible_objects = {utils.make_key(obj): obj for obj in context.visible_objects}
+
+            for key in proxy_keys:
+                # Don't try again if the conversion fails
+                self.exported_objects[key].is_proxy = False
+                obj = visible_objects.get(key)
+                if obj:
+                    self._convert_object(props, obj, context.scene, context, luxcore_scene, use_lod=False)
+
+            luxcore_scene.Parse(self.property_diff.filter(props))
+        except Exception as error:
+            print("Error in replace_proxies():", error)
+            import traceback
+            traceback.print_exc()
+        finally:
+            session.EndSceneEdit()
+
+    def _convert_object(self, props, obj, scene, context, luxcore_scene, definition_pool=None,
+                        geometry_cache=None, use_lod=True):
+        lod = self.lod if context and use_lod else None
+        bake = self.instancing is not None and not context and self.instancing.should_bake(obj)
         # Note: exported_obj can also be an instance of ExportedLight, but they behave the same
-        obj_props, exported_obj = blender_object.convert(obj, scene, context, luxcore_scene)
+        obj_props, exported_obj = blender_object.convert(obj, scene, context, luxcore_scene, self.mesh_cache,
+                                                          definition_pool, geometry_cache, lod, bake,
+                                                          self.exported_materials)
 
         if exported_obj is None:
             # Error during conversion
             print('Could not convert object "%s"' % obj.name)
-            return
+            return False
+
+        if self.instancing and obj.type != "LAMP":
+            self.instancing.count(exported_obj, bake)
 
         props.Set(obj_props)
         self.exported_objects[utils.make_key(obj)] = exported_obj
+        return True
+
+    def _forget_skipped_objects(self, skipped_luxcore_names):
+        for key, exported_obj in list(self.exported_objects.items()):
+            if skipped_luxcore_names.issuperset(exported_obj.luxcore_names):
+                print('Could not convert object "%s"' % key)
+                del self.exported_objects[key]
+
+    def _update_transform(self, props, obj, scene, context, luxcore_scene):
+        exported_obj = self.exported_objects.get(utils.make_key(obj))
+        transform_props = blender_object.update_transform(obj, scene, exported_obj)
+
+        if transform_props is None:
+            # Not exported yet, or not a mesh object (e.g. area light)
+            self._convert_object(props, obj, scene, context, luxcore_scene)
+        else:
+            props.Set(transform_props)
+
+    def _forget_objects(self, key):
+        exported_obj = self.exported_objects.get(key)
+        if exported_obj:
+            for luxcore_name in exported_obj.luxcore_names:
+                self.property_diff.forget("scene.objects.", luxcore_name)
+
+    def _remove_exported(self, key, luxcore_scene):
+        exported_thing = self.exported_objects.pop(key, None)
+
+        if exported_thing is None:
+            return
+
+        # exported_objects contains instances of ExportedObject and ExportedLight
+        if isinstance(exported_thing, blender_object.ExportedObject):
+            remove_func = luxcore_scene.DeleteObject
+        else:
+            remove_func = luxcore_scene.DeleteLight
+
+        for luxcore_name in exported_thing.luxcore_names:
+            remove_func(luxcore_name)
+            self.property_diff.forget("scene.objects.", luxcore_name)
+            self.property_diff.forget("scene.lights.", luxcore_name)
 
     def _update_config(self, session, config_props):
         renderconfig = session.GetRenderConfig()
@@ -275,12 +626,23 @@ class Exporter(object):
 
         if changes & Change.OBJECT:
             for obj in self.object_cache.changed_transform:
-                # TODO only update transform
+                if obj in self.object_cache.changed_mesh:
+                    # Will be re-exported completely below
+                    continue
+                if not utils.is_obj_visible(obj, context.scene, context):
+                    # Parked objects get their new transformation when they are unhidden
+                    continue
                 print("transformed:", obj.name)
-                self._convert_object(props, obj, context.scene, context, luxcore_scene)
+                self._update_transform(props, obj, context.scene, context, luxcore_scene)
 
             for obj in self.object_cache.changed_mesh:
+                if not utils.is_obj_visible(obj, context.scene, context):
+                    # The parked shapes are outdated
+                    self.parked_objects.discard(utils.make_key(obj))
+                    continue
                 print("mesh changed:", obj.name)
+                # The shapes are re-defined under the same names, send the objects again
+                self._forget_objects(utils.make_key(obj))
                 self._convert_object(props, obj, context.scene, context, luxcore_scene)
 
             for obj in self.object_cache.lamps:
@@ -288,41 +650,47 @@ class Exporter(object):
                 self._convert_object(props, obj, context.scene, context, luxcore_scene)
 
         if changes & Change.MATERIAL:
+            for node_tree in self.material_cache.changed_volumes:
+                self.exported_materials.discard_volume(node_tree)
             for mat in self.material_cache.changed_materials:
-                luxcore_name, mat_props = material.convert(mat)
-                props.Set(mat_props)
+                self.exported_materials.update(mat, props)
 
         if changes & Change.VISIBILITY:
+            # All visibility changes (e.g. switching a layer with many objects) are applied in this scene edit
+            scene_objects = {utils.make_key(obj): obj for obj in context.scene.objects}
+            visible_objects = {utils.make_key(obj): obj for obj in context.visible_objects}
+
             for key in self.visibility_cache.objects_to_remove:
                 if key not in self.exported_objects:
                     print('WARNING: Can not delete key "%s" from luxcore_scene' % key)
                     print("The object was probably renamed")
                     continue
 
-                exported_thing = self.exported_objects[key]
+                obj = scene_objects.get(key)
+                if obj and obj not in self.object_cache.changed_mesh:
+                    self.parked_objects.park(key, self.exported_objects[key])
+                self._remove_exported(key, luxcore_scene)
 
-                if exported_thing is None:
-                    print('Value for key "%s" is None!' % key)
+            for key in self.visibility_cache.objects_to_add:
+                if key in self.exported_objects:
+                    # Already converted above because it also changed
+                    self.parked_objects.discard(key)
                     continue
 
-                # exported_objects contains instances of ExportedObject and ExportedLight
-                if isinstance(exported_thing, blender_object.ExportedObject):
-                    remove_func = luxcore_scene.DeleteObject
-                else:
-                    remove_func = luxcore_scene.DeleteLight
-
-                for luxcore_name in exported_thing.luxcore_names:
-                    remove_func(luxcore_name)
-
-                del self.exported_objects[key]
+                obj = visible_objects.get(key)
+                exported_obj = self.parked_objects.unpark(key, luxcore_scene)
 
-            for key in self.visibility_cache.objects_to_add:
-                obj = utils.obj_from_key(key, context.visible_objects)
-                self._convert_object(props, obj, context.scene, context, luxcore_scene)
+                if exported_obj:
+                    # Only the LuxCore objects have to be created again
+                    props.Set(blender_object.update_transform(obj, context.scene, exported_obj))
+                    self.exported_objects[key] = exported_obj
+                else:
+                    self._convert_object(props, obj, context.scene, context, luxcore_scene)
 
         if changes & Change.WORLD:
             if context.scene.world.luxcore.light == "none":
                 luxcore_scene.DeleteLight(WORLD_BACKGROUND_LIGHT_NAME)
+                self.property_diff.forget("scene.lights.", WORLD_BACKGROUND_LIGHT_NAME)
             else:
                 world_props = light.convert_world(context.scene.world, context.scene)
                 props.Set(world_props)
@@ -0,0 +1,118 @@
+import bpy
+from .. import utils
+from .mesh_cache import TIME_DEPENDENT_MODIFIERS
+from ..nodes.output import get_active_output
+
+
+class AnimatedData(object):
+    """
+    Everything that might change between the frames of an animation render.
+    The sets contain keys created with utils.make_key().
+    """
+    def __init__(self):
+        self.objects = set()
+        self.materials = set()
+        # Volume node trees, the materials using them are in self.materials
+        self.volumes = set()
+        self.world = False
+
+    def __str__(self):
+        return "%d objects, %d materials, %d volumes, world: %s" % (len(self.objects), len(self.materials),
+                                                                    len(self.volumes), self.world)
+
+
+def find_animated(scene, objs):
+    """
+    Find out which of the objs and their materials are animated (by fcurves, drivers,
+    parenting, constraints or modifiers with animated inputs), and if the world is animated.
+    The camera is not included because it is cheap to convert and compared every frame anyway.
+    """
+    animated = AnimatedData()
+    # Memo for the recursive object check: object key -> bool
+    object_memo = {}
+
+    for obj in objs:
+        if _is_object_animated(obj, object_memo):
+            animated.objects.add(utils.make_key(obj))
+
+        for slot in getattr(obj, "material_slots", []):
+            mat = slot.material
+            if mat is None:
+                continue
+            if _is_material_animated(mat):
+                animated.materials.add(utils.make_key(mat))
+
+            animated_volumes = _find_animated_volumes(mat)
+            if animated_volumes:
+                # The volumes are exported again by the first material using them
+                animated.materials.add(utils.make_key(mat))
+                animated.volumes.update(utils.make_key(volume) for volume in animated_volumes)
+
+        # Node tree is attached to object as fallback for now because of Blender bug.
+        # TODO: waiting for a fix: https://developer.blender.org/T53509
+        if _has_animation(obj.luxcore.node_tree):
+            animated.objects.add(utils.make_key(obj))
+
+    world = scene.world
+    if world:
+        sun = world.luxcore.sun
+        animated.world = _has_animation(world) or (sun is not None and _is_object_animated(sun, object_memo))
+
+    return animated
+
+
+def _has_animation(id_block):
+    if id_block is None:
+        return False
+    anim_data = getattr(id_block, "animation_data", None)
+    return anim_data is not None and (anim_data.action is not None or len(anim_data.drivers) > 0)
+
+
+def _is_object_animated(obj, memo):
+    key = utils.make_key(obj)
+    if key in memo:
+        return memo[key]
+    # Guard against dependency cycles
+    memo[key] = False
+
+    result = (
+        _has_animation(obj)
+        or _has_animation(obj.data)
+        or _has_animation(getattr(obj.data, "shape_keys", None))
+        or len(obj.constraints) > 0
+        or (obj.parent is not None and _is_object_animated(obj.parent, memo))
+        or _are_modifiers_animated(obj, memo)
+    )
+
+    memo[key] = result
+    return result
+
+
+def _are_modifiers_animated(obj, memo):
+    for modifier in obj.modifiers:
+        if modifier.type in TIME_DEPENDENT_MODIFIERS:
+            return True
+
+        # Modifiers like Armature, Boolean or Array depend on other objects
+        for prop in modifier.bl_rna.properties:
+            if prop.type != "POINTER" or prop.identifier == "rna_type":
+                continue
+            value = getattr(modifier, prop.identifier, None)
+            if isinstance(value, bpy.types.Object) and _is_object_animated(value, memo):
+                return True
+    return False
+
+
+def _is_material_animated(mat):
+    return _has_animation(mat) or _has_animation(mat.luxcore.node_tree)
+
+
+def _find_animated_volumes(mat):
+    node_tree = mat.luxcore.node_tree
+    if node_tree is None:
+        return []
+    active_output = get_active_output(node_tree, "LuxCoreNodeMatOutput")
+    if active_output is None:
+        return []
+    return [volume for volume in (active_output.interior_volume, active_output.exterior_volume)
+            if volume and _has_animation(volume)]
@@ -1,13 +1,22 @@
 import bpy
+from time import time
 from ..bin import pyluxcore
 from .. import utils
 from ..utils import ExportedObject
 
-from . import material
+from . import material, mesh
+from .lod import SHAPE_KEY_SUFFIX
+from .mesh_cache import calc_fingerprint, calc_shape_key
+from .parked import estimate_mesh_size
 from .light import convert_lamp
 
 
-def convert(blender_obj, scene, context, luxcore_scene):
+def convert(blender_obj, scene, context, luxcore_scene, mesh_cache=None, definition_pool=None,
+            geometry_cache=None, lod=None, bake_transformation=False, material_cache=None):
+    """
+    If bake_transformation is True, the transformation is applied to the shapes instead of the objects.
+    This results in a flatter acceleration structure, but the shapes can't be shared with other objects.
+    """
     if not utils.is_obj_visible(blender_obj, scene, context):
         return pyluxcore.Properties(), None
 
@@ -16,7 +25,7 @@ def convert(blender_obj, scene, context, luxcore_scene):
 
     try:
         print("converting object:", blender_obj.name)
-        # Note that his is not the final luxcore_name, as the object may be split by DefineBlenderMesh()
+        # Note that his is not the final luxcore_name, as the object may be split by material
         luxcore_name = utils.to_luxcore_name(blender_obj.name)
         props = pyluxcore.Properties()
 
@@ -25,32 +34,136 @@ def convert(blender_obj, scene, context, luxcore_scene):
             return props, None
 
         modifier_mode = "PREVIEW" if context else "RENDER"
-        apply_modifiers = True
-        mesh = blender_obj.to_mesh(scene, apply_modifiers, modifier_mode)
+        transformation = utils.matrix_to_list(blender_obj.matrix_world, scene)
+        shape_key = None
+        mesh_fingerprint = None
+        mesh_definitions = None
+        mesh_size = 0
 
-        if mesh is None or len(mesh.tessfaces) == 0:
-            print("No mesh data after to_mesh()")
-            return props, None
+        subsurf = None
+        if scene.luxcore.performance.use_luxcore_subdivision:
+            subsurf = _find_luxcore_subdivision(blender_obj, modifier_mode)
+
+        if mesh_cache:
+            shape_key, mesh_fingerprint = calc_fingerprint(blender_obj, scene, modifier_mode, subsurf, mesh_cache)
+            if lod and shape_key is not None:
+                # The viewport proxy is cached separately from the full resolution mesh
+                shape_key += SHAPE_KEY_SUFFIX
+            if not bake_transformation:
+                mesh_definitions = mesh_cache.get(shape_key, mesh_fingerprint, luxcore_scene, definition_pool)
+
+        if shape_key is None or bake_transformation:
+            # The shapes can not be shared with other objects
+            shape_name = luxcore_name
+        else:
+            shape_name = utils.to_luxcore_name(shape_key)
+
+        if mesh_definitions is None:
+            use_buffers = scene.luxcore.performance.mesh_export_mode == "BUFFERS"
+            parts = None
+            topology = None
+            shape_transformation = transformation if bake_transformation else None
+
+            if use_buffers and geometry_cache:
+                parts = geometry_cache.load(mesh_fingerprint)
+
+            if parts is None:
+                apply_modifiers = True
+                # The buffer export triangulates the polygons itself, no need to calculate tessfaces
+                calc_tessface = not use_buffers
+                if subsurf:
+                    # Only export the cage, LuxCore subdivides it
+                    blender_mesh = _cage_to_mesh(blender_obj, scene, modifier_mode, calc_tessface)
+                else:
+                    blender_mesh = blender_obj.to_mesh(scene, apply_modifiers, modifier_mode, calc_tessface)
+
+                if blender_mesh is None or len(blender_mesh.polygons) == 0:
+                    print("No mesh data after to_mesh()")
+                    return props, None
+
+                if use_buffers:
+                    topology = mesh_cache.get_topology(shape_key) if mesh_cache else None
+
+                    if topology and topology.matches(blender_mesh):
+                        # Only the vertices moved, skip triangulation and material split
+                        print("Updating vertices of deformed mesh:", shape_name)
+                        parts = mesh.update_vertices(blender_mesh, topology)
+                    else:
+                        parts = _extract_mesh_parts(shape_name, blender_mesh)
+                        # Only remember the topology of meshes that are exported more than once
+                        # (edited in the viewport or animated), it costs memory
+                        if mesh_cache and mesh_cache.has(shape_key) and not bake_transformation:
+                            topology = mesh.Topology.create(blender_mesh, parts)
+
+                    if geometry_cache:
+                        geometry_cache.save(mesh_fingerprint, parts)
+                    if lod and shape_key is not None:
+                        parts = lod.create_proxy(shape_key, mesh_fingerprint, parts)
+                else:
+                    mesh_definitions = _convert_mesh_to_shapes(shape_name, blender_mesh, luxcore_scene,
+                                                               shape_transformation)
+                    # Each polygon is split into loop_total - 2 triangles
+                    loop_count = len(blender_mesh.loops)
+                    mesh_size = estimate_mesh_size(loop_count, loop_count - 2 * len(blender_mesh.polygons))
+                bpy.data.meshes.remove(blender_mesh, do_unlink=False)
+            else:
+                print("Using geometry cache file for object:", blender_obj.name)
 
-        mesh_definitions = _convert_mesh_to_shapes(luxcore_name, mesh, luxcore_scene)
-        bpy.data.meshes.remove(mesh, do_unlink=False)
+            if parts is not None:
+                mesh_definitions = _define_mesh_parts(shape_name, parts, luxcore_scene, definition_pool,
+                                                      shape_transformation)
+                mesh_size = sum(estimate_mesh_size(len(buffers.vertices), buffers.triangle_count)
+                                for material_index, buffers in parts)
 
-        for lux_object_name, material_index in mesh_definitions:
+            if mesh_cache and not bake_transformation:
+                mesh_cache.set(shape_key, mesh_fingerprint, mesh_definitions, topology, mesh_size)
+        else:
+            print("Using cached mesh of object:", blender_obj.name)
+            mesh_size = mesh_cache.get_mesh_size(shape_key)
+
+        if subsurf:
+            # LuxCore subdivision splits each face into four per level
+            levels = subsurf.levels if context else subsurf.render_levels
+            mesh_size *= 4 ** levels
+
+        object_transformation = None if bake_transformation else transformation
+        luxcore_names = []
+        shape_names = []
+        material_names = []
+
+        for shape_name_part, material_index in mesh_definitions:
             if material_index < len(blender_obj.material_slots):
                 mat = blender_obj.material_slots[material_index].material
-                # TODO material cache
-                lux_mat_name, mat_props = material.convert(mat)
             else:
                 # The object has no material slots
-                lux_mat_name, mat_props = material.fallback()
+                mat = None
 
-            props.Set(mat_props)
+            if material_cache:
+                lux_mat_name = material_cache.convert(mat, props)
+            else:
+                if mat:
+                    lux_mat_name, mat_props = material.convert(mat)
+                else:
+                    lux_mat_name, mat_props = material.fallback()
+                props.Set(mat_props)
+
+            # This prefix is hardcoded in Scene_DefineBlenderMesh1 in the LuxCore API
+            luxcore_shape_name = "Mesh-" + shape_name_part
+            if subsurf:
+                luxcore_shape_name = _define_subdivision(props, luxcore_shape_name, levels)
+            # The shape might be shared with other objects, so the object needs its own name
+            lux_object_name = "%s%03d" % (luxcore_name, material_index)
+            _define_luxcore_object(props, lux_object_name, luxcore_shape_name, lux_mat_name, object_transformation)
 
-            transformation = utils.matrix_to_list(blender_obj.matrix_world, scene)
-            _define_luxcore_object(props, lux_object_name, lux_mat_name, transformation)
+            luxcore_names.append(lux_object_name)
+            shape_names.append(luxcore_shape_name)
+            material_names.append(lux_mat_name)
 
-        luxcore_names = [lux_obj_name for lux_obj_name, material_index in mesh_definitions]
-        return props, ExportedObject(luxcore_names)
+        if bake_transformation:
+            # The shapes can't be re-used with another transformation, see update_transform()
+            shape_names = None
+        is_proxy = lod is not None and lod.is_proxy(shape_key)
+        return props, ExportedObject(luxcore_names, shape_names, material_names, is_proxy, mesh_size)
     except Exception as error:
         # TODO: collect exporter errors
         print("ERROR in object", blender_obj.name)
@@ -58,9 +171,40 @@ def convert(blender_obj, scene, context, luxcore_scene):
         return pyluxcore.Properties(), None
 
 
-def _define_luxcore_object(props, lux_object_name, lux_material_name, transformation=None):
-    # This prefix is hardcoded in Scene_DefineBlenderMesh1 in the LuxCore API
-    luxcore_shape_name = "Mesh-" + lux_object_name
+def get_shape_key(blender_obj, scene, context=None):
+    """
+    The shape_key convert() uses for the object, objects with the same shape_key share their shapes.
+    None if the shapes of the object are never shared.
+    """
+    modifier_mode = "PREVIEW" if context else "RENDER"
+    subsurf = None
+    if scene.luxcore.performance.use_luxcore_subdivision:
+        subsurf = _find_luxcore_subdivision(blender_obj, modifier_mode)
+    return calc_shape_key(blender_obj, scene, modifier_mode, subsurf)
+
+
+def update_transform(blender_obj, scene, exported_obj):
+    """
+    Re-define the LuxCore objects of an already exported Blender object with its new transformation.
+    The shapes are instanced (not baked) in viewport render, so they can be re-used as they are.
+    Returns the new properties, or None if a full conversion is needed.
+    """
+    if not isinstance(exported_obj, ExportedObject) or exported_obj.shape_names is None:
+        return None
+
+    props = pyluxcore.Properties()
+    transformation = utils.matrix_to_list(blender_obj.matrix_world, scene)
+    definitions = zip(exported_obj.luxcore_names, exported_obj.shape_names, exported_obj.material_names)
+
+    for lux_object_name, luxcore_shape_name, lux_material_name in definitions:
+        # We have to set shape and material again because setting one property
+        # of a LuxCore object deletes all other properties of this object
+        _define_luxcore_object(props, lux_object_name, luxcore_shape_name, lux_material_name, transformation)
+
+    return props
+
+
+def _define_luxcore_object(props, lux_object_name, luxcore_shape_name, lux_material_name, transformation=None):
     prefix = "scene.objects." + lux_object_name + "."
     props.Set(pyluxcore.Property(prefix + "material", lux_material_name))
     props.Set(pyluxcore.Property(prefix + "shape", luxcore_shape_name))
@@ -68,7 +212,59 @@ def _define_luxcore_object(props, lux_object_name, lux_material_name, transforma
         props.Set(pyluxcore.Property(prefix + "transformation", transformation))
 
 
-def _convert_mesh_to_shapes(name, mesh, luxcore_scene):
+def _find_luxcore_subdivision(blender_obj, modifier_mode):
+    """
+    Returns the Subdivision Surface modifier at the end of the modifier stack if it
+    can be replaced by LuxCore subdivision, otherwise None.
+    """
+    show_attr = "show_viewport" if modifier_mode == "PREVIEW" else "show_render"
+    enabled_modifiers = [modifier for modifier in blender_obj.modifiers if getattr(modifier, show_attr)]
+
+    if not enabled_modifiers or enabled_modifiers[-1].type != "SUBSURF":
+        return None
+
+    subsurf = enabled_modifiers[-1]
+    if subsurf.subdivision_type != "CATMULL_CLARK":
+        # LuxCore only supports Catmull-Clark, "SIMPLE" subdivision keeps the shape
+        return None
+
+    levels = subsurf.levels if modifier_mode == "PREVIEW" else subsurf.render_levels
+    if levels == 0:
+        return None
+
+    if not _is_cage_unmodified(blender_obj, enabled_modifiers):
+        # We would have to disable the modifier temporarily, which writes to the scene data
+        # (and triggers another viewport update) while the UI is still running
+        return None
+
+    return subsurf
+
+
+def _is_cage_unmodified(blender_obj, enabled_modifiers):
+    """ True if the object data without any modifiers is the cage of the Subdivision Surface """
+    return len(enabled_modifiers) == 1 and getattr(blender_obj.data, "shape_keys", None) is None
+
+
+def _cage_to_mesh(blender_obj, scene, modifier_mode, calc_tessface):
+    """ The Subdivision Surface is the only modifier (see _find_luxcore_subdivision()), so the cage is the base mesh """
+    return blender_obj.to_mesh(scene, False, modifier_mode, calc_tessface)
+
+
+def _define_subdivision(props, luxcore_shape_name, levels):
+    """
+    Define a LuxCore subdiv shape on top of the exported cage.
+    Returns the name of the subdiv shape, which has to be used by the objects.
+    """
+    # Objects with different levels can share the cage
+    subdiv_shape_name = "%s_subdiv%d" % (luxcore_shape_name, levels)
+    prefix = "scene.shapes." + subdiv_shape_name + "."
+    props.Set(pyluxcore.Property(prefix + "type", "subdiv"))
+    props.Set(pyluxcore.Property(prefix + "source", luxcore_shape_name))
+    props.Set(pyluxcore.Property(prefix + "maxlevel", levels))
+    return subdiv_shape_name
+
+
+def _convert_mesh_to_shapes(name, mesh, luxcore_scene, transformation=None):
     faces = mesh.tessfaces[0].as_pointer()
     vertices = mesh.vertices[0].as_pointer()
 
@@ -85,8 +281,40 @@ def _convert_mesh_to_shapes(name, mesh, luxcore_scene):
     else:
         vertexColors = 0
 
-    # TODO
-    transformation = None # if self.use_instancing else self.transformation
-
     return luxcore_scene.DefineBlenderMesh(name, len(mesh.tessfaces), faces, len(mesh.vertices),
-                                           vertices, texCoords, vertexColors, transformation)
\ No newline at end of file
+                                           vertices, texCoords, vertexColors, transformation)
+
+
+def _extract_mesh_parts(name, blender_mesh):
+    """
+    Alternative to _convert_mesh_to_shapes() that reads the mesh with foreach_get.
+    Returns a list of (material_index, MeshBuffers), see mesh.extract().
+    """
+    start = time()
+    parts = mesh.extract(blender_mesh)
+    extraction_time = time() - start
+
+    triangle_count = sum(buffers.triangle_count for material_index, buffers in parts)
+    print("Mesh %s: extracted %d triangles in %.3fs (%d triangles/s)"
+          % (name, triangle_count, extraction_time, triangle_count / max(extraction_time, 1e-6)))
+    return parts
+
+
+def _define_mesh_parts(name, parts, luxcore_scene, definition_pool=None, transformation=None):
+    """
+    Defines the shapes with DefineMesh(). Returns the same list as DefineBlenderMesh().
+    If a definition_pool is passed, the shapes are defined by its worker threads.
+    If a transformation is passed, it is baked into the vertices.
+    """
+    mesh_definitions = []
+
+    for material_index, buffers in parts:
+        # Same naming scheme as DefineBlenderMesh()
+        shape_name_part = "%s%03d" % (name, material_index)
+        if definition_pool:
+            definition_pool.submit("Mesh-" + shape_name_part, buffers, transformation)
+        else:
+            mesh.define(luxcore_scene, "Mesh-" + shape_name_part, buffers, transformation)
+        mesh_definitions.append((shape_name_part, material_index))
+
+    return mesh_definitions
@@ -0,0 +1,65 @@
+from ..bin import pyluxcore
+
+# Prefixes in the order they have to be parsed: volumes can use textures,
+# materials can use volumes and textures, objects use shapes and materials
+PARSE_ORDER = (
+    "scene.textures.",
+    "scene.volumes.",
+    "scene.materials.",
+    "scene.shapes.",
+    "scene.objects.",
+    "scene.lights.",
+)
+
+
+class ChunkedParser(object):
+    """
+    Drop-in replacement for the scene Properties during export.
+    Instead of collecting the definitions of the whole scene, they are parsed into
+    the luxcore_scene whenever chunk_size properties have been collected.
+    """
+    def __init__(self, luxcore_scene, chunk_size, definition_pool=None):
+        self.luxcore_scene = luxcore_scene
+        self.chunk_size = chunk_size
+        # Objects can only be parsed after their shapes are defined
+        self.definition_pool = definition_pool
+        self._props = pyluxcore.Properties()
+        self.chunk_count = 0
+        self.total_size = 0
+        self.peak_size = 0
+
+    def Set(self, props):
+        self._props.Set(props)
+        if self._props.GetSize() >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        size = self._props.GetSize()
+        if size == 0:
+            return
+
+        self.peak_size = max(self.peak_size, size)
+        self.total_size += size
+        self.chunk_count += 1
+
+        if self.definition_pool:
+            self.definition_pool.wait_defined()
+            self._props = self.definition_pool.filter_failed(self._props)
+
+        for prefix in PARSE_ORDER:
+            chunk = self._props.GetAllProperties(prefix)
+            if chunk.GetSize():
+                self.luxcore_scene.Parse(chunk)
+
+        rest = pyluxcore.Properties()
+        for name in self._props.GetAllNames():
+            if not name.startswith(PARSE_ORDER):
+                rest.Set(self._props.Get(name))
+        if rest.GetSize():
+            self.luxcore_scene.Parse(rest)
+
+        self._props = pyluxcore.Properties()
+
+    def print_stats(self):
+        print("Chunked parse: %d properties in %d chunks, peak %d properties in memory"
+              % (self.total_size, self.chunk_count, self.peak_size))
@@ -0,0 +1,204 @@
+import json
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+from time import time
+import numpy as np
+from .mesh import MeshBuffers
+
+# Change the version if the file layout or the content of MeshBuffers changes
+MAGIC = b"LXGEOMETRY2\n"
+FILE_EXTENSION = ".lxgeo"
+ALIGNMENT = 16
+BUFFER_NAMES = ("vertices", "faces", "normals", "uvs", "colors")
+
+
+def default_directory():
+    return os.path.join(tempfile.gettempdir(), "BlendLuxCore_geometry_cache")
+
+
+class GeometryCache(object):
+    """
+    Persistent on-disk cache of exported mesh buffers, keyed by the mesh fingerprint.
+    Each entry is one file: a small JSON header describing the arrays, followed by the raw array data.
+    Files are memory-mapped when loaded, so the buffers are read without copying.
+    When the size limit is exceeded, the least recently used entries are deleted.
+    """
+    def __init__(self, directory, max_size):
+        """
+        :param directory: cache directory, created if it does not exist
+        :param max_size: size limit in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Maps file path -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        # Sum of the sizes in self._entries
+        self._total_size = 0
+        files = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(FILE_EXTENSION):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        # The modification time is updated when an entry is used, see _touch()
+        for last_use, path, size in sorted(files):
+            self._add(path, size)
+
+    def load(self, fingerprint):
+        """
+        Returns a list of (material_index, MeshBuffers) tuples, or None if the fingerprint is not cached.
+        """
+        path = self._path(fingerprint)
+        if fingerprint is None or path not in self._entries:
+            self.misses += 1
+            return None
+
+        try:
+            parts = _read_file(path)
+        except Exception as error:
+            print("Could not read geometry cache file %s: %s" % (path, error))
+            self._delete(path)
+            self.misses += 1
+            return None
+
+        self._touch(path)
+        self.hits += 1
+        return parts
+
+    def save(self, fingerprint, parts):
+        if fingerprint is None:
+            return
+
+        path = self._path(fingerprint)
+        temp_path = path + ".tmp"
+        try:
+            _write_file(temp_path, parts)
+            os.replace(temp_path, path)
+        except OSError as error:
+            print("Could not write geometry cache file %s: %s" % (path, error))
+            return
+
+        self._add(path, os.path.getsize(path))
+        self._evict()
+
+    def clear(self):
+        """ Delete all entries, returns the number of deleted files """
+        count = 0
+        for path in list(self._entries):
+            if self._delete(path):
+                count += 1
+        return count
+
+    def _path(self, fingerprint):
+        return os.path.join(self.directory, str(fingerprint) + FILE_EXTENSION)
+
+    def _add(self, path, size):
+        if path in self._entries:
+            # Overwritten
+            self._total_size -= self._entries.pop(path)
+        self._entries[path] = size
+        self._total_size += size
+
+    def _touch(self, path):
+        self._entries.move_to_end(path)
+        now = time()
+        try:
+            # Persist the access time for the next session (mtime is more reliable than atime)
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+    def _evict(self):
+        excess = self._total_size - self.max_size
+        if excess <= 0:
+            return
+
+        # The entries are ordered from least to most recently used
+        least_recently_used = []
+        for path, size in self._entries.items():
+            if excess <= 0:
+                break
+            least_recently_used.append(path)
+            excess -= size
+
+        for path in least_recently_used:
+            self._delete(path)
+
+    def _delete(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # E.g. still memory-mapped on Windows, try again next time
+            return False
+        self._total_size -= self._entries.pop(path, 0)
+        return True
+
+
+def _write_file(path, parts):
+    header = {"parts": []}
+    arrays = []
+    offset = 0
+
+    for material_index, buffers in parts:
+        part_header = {"material_index": material_index, "buffers": {}}
+
+        for name in BUFFER_NAMES:
+            array = getattr(buffers, name)
+            if array is None:
+                continue
+            array = np.ascontiguousarray(array)
+            part_header["buffers"][name] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+            arrays.append((offset, array))
+            offset += _aligned(array.nbytes)
+
+        header["parts"].append(part_header)
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _aligned(len(MAGIC) + 4 + len(header_bytes))
+
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<I", len(header_bytes)))
+        file.write(header_bytes)
+
+        for array_offset, array in arrays:
+            file.seek(data_start + array_offset)
+            file.write(array.tobytes())
+
+
+def _read_file(path):
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise Exception("Unknown file format")
+        header_length = struct.unpack("<I", file.read(4))[0]
+        header = json.loads(file.read(header_length).decode())
+
+    data_start = _aligned(len(MAGIC) + 4 + header_length)
+    raw = np.memmap(path, dtype=np.uint8, mode="r")
+    parts = []
+
+    for part_header in header["parts"]:
+        buffers = {}
+        for name, info in part_header["buffers"].items():
+            dtype = np.dtype(info["dtype"])
+            count = int(np.prod(info["shape"]))
+            start = data_start + info["offset"]
+            end = start + count * dtype.itemsize
+            buffers[name] = raw[start:end].view(dtype).reshape(info["shape"])
+
+        parts.append((part_header["material_index"], MeshBuffers(**buffers)))
+
+    return parts
+
+
+def _aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
@@ -1,14 +1,40 @@
 import bpy
+import hashlib
 import tempfile
 import os
+import re
+from time import time
 from .. import utils
 
+# File extensions of the formats Image.save_render() can write, LuxCore detects the format by extension
+FILE_EXTENSIONS = {
+    "BMP": ".bmp",
+    "PNG": ".png",
+    "JPEG": ".jpg",
+    "JPEG2000": ".jp2",
+    "TARGA": ".tga",
+    "TARGA_RAW": ".tga",
+    "TIFF": ".tif",
+    "OPEN_EXR": ".exr",
+    "OPEN_EXR_MULTILAYER": ".exr",
+    "HDR": ".hdr",
+}
+# Names of the files written by the ImageCache: md5 hex digest and one of the extensions above
+_CACHE_FILE_NAME = re.compile(r"^[0-9a-f]{32}(%s)?$" % "|".join(re.escape(extension)
+                                                              for extension in set(FILE_EXTENSIONS.values())))
+
+
+def default_directory():
+    return os.path.join(tempfile.gettempdir(), "BlendLuxCore_image_cache")
+
 
 class ImageExporter(object):
     """
     This class is a singleton
     """
+    # Maps image key -> file path in the image cache, for the lifetime of the Blender process
     temp_images = {}
+    _cache = None
 
     @classmethod
     def _save_to_temp_file(cls, image, scene):
@@ -16,13 +42,34 @@ class ImageExporter(object):
 
         if key in cls.temp_images:
             # Image was already exported
-            temp_image = cls.temp_images[key]
-        else:
-            temp_image = tempfile.NamedTemporaryFile(delete=False)
-            cls.temp_images[key] = temp_image
-            image.save_render(temp_image.name, scene)
+            return cls.temp_images[key]
 
-        return temp_image.name
+        if scene is None:
+            scene = bpy.context.scene
+        cache = cls._get_cache(scene)
+        settings = scene.render.image_settings
+        path = cache.get_path(_content_hash(image, scene), FILE_EXTENSIONS.get(settings.file_format, ""))
+
+        if not cache.load(path):
+            # Write to a temporary file first, so an interrupted save does not leave a broken cache entry
+            temp_path = path + ".tmp"
+            image.save_render(temp_path, scene)
+            os.replace(temp_path, path)
+            cache.save(path)
+
+        cls.temp_images[key] = path
+        return path
+
+    @classmethod
+    def _get_cache(cls, scene):
+        performance = scene.luxcore.performance
+        directory = bpy.path.abspath(performance.image_cache_dir) or default_directory()
+        max_size = performance.image_cache_size * 1024 * 1024
+
+        if cls._cache is None or cls._cache.directory != directory:
+            cls._cache = ImageCache(directory, max_size)
+        cls._cache.max_size = max_size
+        return cls._cache
 
     @classmethod
     def export(cls, image, scene=None):
@@ -40,10 +87,121 @@ class ImageExporter(object):
             raise Exception('Unsupported image source "%s" in image "%s"' % (image.source, image.name))
 
     @classmethod
-    def cleanup(cls):
-        for temp_image in cls.temp_images.values():
-            print("Deleting temporary image:", temp_image.name)
-            os.remove(temp_image.name)
+    def print_stats(cls):
+        if cls._cache:
+            print("Image cache: %d hits, %d misses" % (cls._cache.hits, cls._cache.misses))
 
+    @classmethod
+    def cleanup(cls):
+        # The cached images are kept for the next session, only the size limit is enforced
         cls.temp_images = {}
+        if cls._cache:
+            cls.print_stats()
+            cls._cache.evict()
+        cls._cache = None
+
+
+class ImageCache(object):
+    """
+    Persistent on-disk cache of packed and generated images, saved so LuxCore can load them.
+    The files are named after a hash of the image content and the save settings, so they are re-used
+    in later sessions. When the size limit is exceeded, the least recently used files are deleted.
+    """
+    def __init__(self, directory, max_size):
+        """
+        :param directory: cache directory, created if it does not exist
+        :param max_size: size limit in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Maps file path -> [last use time, size in bytes]
+        self._entries = {}
+        for entry in os.scandir(directory):
+            # The directory can be chosen by the user, only manage the files written by this cache
+            if entry.is_file() and _CACHE_FILE_NAME.match(entry.name):
+                stat = entry.stat()
+                self._entries[entry.path] = [stat.st_mtime, stat.st_size]
+
+    def get_path(self, content_hash, extension):
+        return os.path.join(self.directory, content_hash + extension)
+
+    def load(self, path):
+        """ Returns True if the image file is cached """
+        if path not in self._entries or not os.path.exists(path):
+            self._entries.pop(path, None)
+            self.misses += 1
+            return False
+
+        now = time()
+        self._entries[path][0] = now
+        try:
+            # Persist the access time for the next session (mtime is more reliable than atime)
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+        self.hits += 1
+        return True
+
+    def save(self, path):
+        """ Call after the image was written to path """
+        try:
+            size = os.path.getsize(path)
+        except OSError as error:
+            print("Could not save image to cache file %s: %s" % (path, error))
+            return
+
+        self._entries[path] = [time(), size]
+        # The image that was just saved is still needed, never delete it
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        total_size = sum(size for last_use, size in self._entries.values())
+        if total_size <= self.max_size:
+            return
+
+        least_recently_used = sorted(self._entries.items(), key=lambda item: item[1][0])
+        for path, (last_use, size) in least_recently_used:
+            if total_size <= self.max_size:
+                break
+            if path == keep or path in ImageExporter.temp_images.values():
+                # Still referenced by the luxcore_scene
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            del self._entries[path]
+            total_size -= size
+
+
+def _content_hash(image, scene):
+    """ Hash of everything that changes the file written by Image.save_render() """
+    h = hashlib.md5()
+    settings = scene.render.image_settings
+    view_settings = scene.view_settings
+    h.update(str((settings.file_format, settings.color_mode, settings.color_depth, settings.compression,
+                  settings.quality, view_settings.view_transform, view_settings.look, view_settings.exposure,
+                  view_settings.gamma, tuple(image.size), image.alpha_mode,
+                  image.colorspace_settings.name)).encode())
+
+    if image.is_dirty:
+        # Painted or otherwise modified in Blender, the pixels are not described by any setting.
+        # Hashing them would be too slow, so the file is only re-used in this session (see temp_images).
+        h.update(str((utils.make_key(image), time())).encode())
+    elif image.packed_file:
+        packed_data = getattr(image.packed_file, "data", None)
+        if packed_data:
+            h.update(packed_data)
+        else:
+            h.update(str((image.filepath, image.packed_file.size)).encode())
+    else:
+        # Generated images are described by their settings
+        h.update(str((image.generated_type, image.generated_width, image.generated_height,
+                      tuple(image.generated_color), image.use_generated_float)).encode())
 
+    return h.hexdigest()
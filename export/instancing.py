@@ -0,0 +1,43 @@
+from collections import Counter
+from .. import utils
+from .blender_object import get_shape_key
+
+
+class InstancingPolicy(object):
+    """
+    Decides if the transformation of an object is baked into its shapes (final render only).
+    Baked shapes result in a flatter, faster acceleration structure, but each object needs its own copy.
+    Shapes used by fewer objects than the threshold are baked, the others are instanced.
+    """
+    def __init__(self, scene, objs, threshold):
+        self.threshold = threshold
+        # Maps object key -> shape_key, see blender_object.get_shape_key()
+        self._shape_keys = {}
+        for obj in objs:
+            if obj.type != "LAMP" and obj.data and utils.is_obj_visible(obj, scene):
+                self._shape_keys[utils.make_key(obj)] = get_shape_key(obj, scene)
+        # Maps shape_key -> number of visible objects using it. Objects whose modifiers reference
+        # other objects get a shape_key of their own, they can't share their shapes.
+        self.shape_users = Counter(shape_key for shape_key in self._shape_keys.values() if shape_key is not None)
+        # Number of exported LuxCore objects
+        self.baked = 0
+        self.instanced = 0
+
+    def should_bake(self, obj):
+        if obj.type == "LAMP" or obj.data is None:
+            return False
+        shape_key = self._shape_keys.get(utils.make_key(obj))
+        if shape_key is None:
+            # Not a mesh, the shapes are never shared
+            return True
+        return self.shape_users[shape_key] < self.threshold
+
+    def count(self, exported_obj, baked):
+        if baked:
+            self.baked += len(exported_obj.luxcore_names)
+        else:
+            self.instanced += len(exported_obj.luxcore_names)
+
+    def print_stats(self):
+        print("Transformations: %d shapes baked, %d shapes instanced (threshold: %d users)"
+              % (self.baked, self.instanced, self.threshold))
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+import numpy as np
+from .mesh import MeshBuffers
+
+# Shapes of proxies get their own names, so they never replace the full resolution shapes
+SHAPE_KEY_SUFFIX = "_lod"
+# Seconds without viewport changes before the proxies are replaced by the full resolution meshes
+IDLE_TIME = 2
+# Size limit of the proxies kept between viewport sessions, in bytes
+MAX_CACHE_SIZE = 512 * 1024 * 1024
+# Attempts to get below the triangle budget with a coarser grid
+MAX_ITERATIONS = 4
+
+# Maps (fingerprint, max_triangles) -> (parts, size in bytes), least recently used first.
+# Module level so proxies survive the restart of the viewport render.
+_proxy_cache = OrderedDict()
+_proxy_cache_size = 0
+
+
+class ViewportLod(object):
+    """
+    Exports decimated proxies of heavy meshes in viewport render.
+    One instance belongs to one Exporter.
+    """
+    def __init__(self, max_triangles):
+        """
+        :param max_triangles: triangle budget per object
+        """
+        self.max_triangles = max_triangles
+        # Shape keys (with SHAPE_KEY_SUFFIX) whose shapes are decimated
+        self.proxy_shape_keys = set()
+
+    def create_proxy(self, shape_key, fingerprint, parts):
+        """
+        Returns the parts decimated to the triangle budget, or the original parts if they are below it.
+        """
+        triangle_count = sum(buffers.triangle_count for material_index, buffers in parts)
+        if triangle_count <= self.max_triangles:
+            self.proxy_shape_keys.discard(shape_key)
+            return parts
+
+        self.proxy_shape_keys.add(shape_key)
+        cache_key = (fingerprint, self.max_triangles)
+
+        if fingerprint is not None and cache_key in _proxy_cache:
+            _proxy_cache.move_to_end(cache_key)
+            return _proxy_cache[cache_key][0]
+
+        proxy_parts = []
+        for material_index, buffers in parts:
+            # Distribute the budget proportionally to the triangle count of the parts
+            budget = max(1, self.max_triangles * buffers.triangle_count // triangle_count)
+            proxy_parts.append((material_index, decimate(buffers, budget)))
+
+        if fingerprint is not None:
+            _cache_proxy(cache_key, proxy_parts)
+        return proxy_parts
+
+    def is_proxy(self, shape_key):
+        return shape_key in self.proxy_shape_keys
+
+
+def decimate(buffers, max_triangles):
+    """
+    Reduce the triangle count of MeshBuffers by vertex clustering: all vertices in a cell
+    of a regular grid are merged, triangles that collapse are removed.
+    Fast and robust (no mesh connectivity needed), but the result is only good enough for a proxy.
+    """
+    if buffers.triangle_count <= max_triangles:
+        return buffers
+
+    vertices = buffers.vertices
+    bbox_min = vertices.min(axis=0)
+    extent = max(float((vertices.max(axis=0) - bbox_min).max()), 1e-6)
+    # On a surface, the triangle count grows with the square of the grid resolution
+    resolution = max(1.0, np.sqrt(max_triangles / 2))
+
+    result = buffers
+    for i in range(MAX_ITERATIONS):
+        coarser = _cluster(buffers, bbox_min, extent / resolution)
+        if coarser.triangle_count == 0:
+            # Everything collapsed, keep the last usable result
+            break
+        result = coarser
+        if result.triangle_count <= max_triangles:
+            break
+        resolution *= np.sqrt(max_triangles / result.triangle_count)
+
+    return result
+
+
+def _cluster(buffers, bbox_min, cell_size):
+    cells = np.floor((buffers.vertices - bbox_min) / cell_size).astype(np.int64)
+    cell_rows = np.ascontiguousarray(cells).view(np.dtype((np.void, cells.dtype.itemsize * 3))).ravel()
+    unique_cells, first_vertices, vertex_to_cluster = np.unique(cell_rows, return_index=True,
+                                                                return_inverse=True)
+    cluster_count = len(unique_cells)
+
+    # Cluster position is the mean of its vertices
+    counts = np.bincount(vertex_to_cluster, minlength=cluster_count).astype(np.float32)
+    vertices = np.column_stack([np.bincount(vertex_to_cluster, buffers.vertices[:, axis], cluster_count)
+                                for axis in range(3)]).astype(np.float32) / counts[:, None]
+
+    faces = vertex_to_cluster[buffers.faces]
+    # Remove collapsed and duplicate triangles
+    valid = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+    faces = faces[valid]
+    sorted_faces = np.ascontiguousarray(np.sort(faces, axis=1))
+    face_rows = sorted_faces.view(np.dtype((np.void, sorted_faces.dtype.itemsize * 3))).ravel()
+    unique_faces, first_faces = np.unique(face_rows, return_index=True)
+    faces = faces[np.sort(first_faces)]
+
+    # Only keep the clusters that are still used
+    used_clusters, faces = np.unique(faces, return_inverse=True)
+    faces = faces.reshape(-1, 3).astype(np.uint32)
+
+    normals = uvs = colors = None
+    if buffers.normals is not None:
+        normals = np.column_stack([np.bincount(vertex_to_cluster, buffers.normals[:, axis], cluster_count)
+                                   for axis in range(3)])[used_clusters]
+        lengths = np.linalg.norm(normals, axis=1)
+        normals = (normals / np.maximum(lengths, 1e-12)[:, None]).astype(np.float32)
+    # Attributes that can't be averaged are taken from one vertex of the cluster
+    if buffers.uvs is not None:
+        uvs = np.ascontiguousarray(buffers.uvs[first_vertices[used_clusters]])
+    if buffers.colors is not None:
+        colors = np.ascontiguousarray(buffers.colors[first_vertices[used_clusters]])
+
+    return MeshBuffers(np.ascontiguousarray(vertices[used_clusters]), faces, normals, uvs, colors)
+
+
+def _cache_proxy(cache_key, parts):
+    global _proxy_cache_size
+
+    size = sum(array.nbytes for material_index, buffers in parts
+               for array in (buffers.vertices, buffers.faces, buffers.normals, buffers.uvs, buffers.colors)
+               if array is not None)
+    _proxy_cache[cache_key] = (parts, size)
+    _proxy_cache_size += size
+
+    while _proxy_cache_size > MAX_CACHE_SIZE and len(_proxy_cache) > 1:
+        old_key, (old_parts, old_size) = _proxy_cache.popitem(last=False)
+        _proxy_cache_size -= old_size
@@ -1,12 +1,19 @@
 from ..bin import pyluxcore
 from .. import utils
 from ..nodes.output import get_active_output
+from .material_hash import calc_structure_hash
 
 
 GLOBAL_FALLBACK_MAT = "__CLAY__"
 
 
-def convert(material):
+def convert(material, material_index=None, exported_volumes=None):
+    """
+    If a material_index is passed, it is used to find the fallback node tree
+    instead of searching all objects.
+    exported_volumes is an optional set of volume node tree keys that are already
+    defined in the luxcore_scene, they are referenced instead of being exported again.
+    """
     try:
         # print("converting material:", material.name)
         props = pyluxcore.Properties()
@@ -17,8 +24,13 @@ def convert(material):
             # Node tree is attached to object as fallback for now because of Blender bug.
             # This only allows to have one material per object.
             # TODO: waiting for a fix: https://developer.blender.org/T53509
-            import bpy
-            for obj in bpy.data.objects:
+            if material_index:
+                objs = material_index.objects_using_material(material)
+            else:
+                import bpy
+                objs = bpy.data.objects
+
+            for obj in objs:
                 if len(obj.material_slots) > 0:
                     mat = obj.material_slots[0].material
                     if mat == material:
@@ -39,7 +51,7 @@ def convert(material):
             return fallback(luxcore_name)
 
         # Now export the material node tree, starting at the output node
-        active_output.export(props, luxcore_name)
+        active_output.export(props, luxcore_name, exported_volumes)
 
         return luxcore_name, props
     except Exception as error:
@@ -49,6 +61,71 @@ def convert(material):
         return fallback()
 
 
+class ConversionCache(object):
+    """
+    Remembers which materials were already converted during the export, so a material
+    shared by many objects is only converted (and its properties only set) once.
+    One instance belongs to one Exporter (the materials are only defined in its luxcore_scene).
+    If deduplicate is enabled, structurally identical materials are converted only once and share
+    one LuxCore material. Only use it if the materials are not updated later (final render), because
+    objects of the other copies keep referencing the shared material.
+    """
+    def __init__(self, material_index=None):
+        self.material_index = material_index
+        self.deduplicate = False
+        # Maps material key (None for empty material slots) -> luxcore_name
+        self._luxcore_names = {}
+        # Maps structure hash -> luxcore_name, only used if deduplicate is enabled
+        self._structure_names = {}
+        # Keys of the volume node trees defined in the luxcore_scene, shared by all materials
+        self.exported_volumes = set()
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+    def convert(self, material, props):
+        """
+        Returns the luxcore_name of the material. Its properties are only set in props if it was not converted yet.
+        """
+        key = None if material is None else utils.make_key(material)
+
+        if key in self._luxcore_names:
+            self.hits += 1
+            return self._luxcore_names[key]
+
+        structure_hash = None
+        if self.deduplicate and material is not None:
+            structure_hash = calc_structure_hash(material)
+            if structure_hash in self._structure_names:
+                self.deduplicated += 1
+                luxcore_name = self._structure_names[structure_hash]
+                self._luxcore_names[key] = luxcore_name
+                return luxcore_name
+
+        self.misses += 1
+        if material is None:
+            luxcore_name, mat_props = fallback()
+        else:
+            luxcore_name, mat_props = convert(material, self.material_index, self.exported_volumes)
+        props.Set(mat_props)
+        self._luxcore_names[key] = luxcore_name
+        if structure_hash:
+            self._structure_names[structure_hash] = luxcore_name
+        return luxcore_name
+
+    def update(self, material, props):
+        """ Convert a material again because it changed """
+        self.discard(material)
+        return self.convert(material, props)
+
+    def discard(self, material):
+        self._luxcore_names.pop(utils.make_key(material), None)
+
+    def discard_volume(self, node_tree):
+        """ The volume is exported again by the next material that references it """
+        self.exported_volumes.discard(utils.make_key(node_tree))
+
+
 def fallback(luxcore_name=GLOBAL_FALLBACK_MAT):
     props = pyluxcore.Properties()
     props.Set(pyluxcore.Property("scene.materials.%s.type" % luxcore_name, "matte"))
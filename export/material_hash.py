@@ -0,0 +1,55 @@
+import hashlib
+import bpy
+from .. import utils
+
+# Properties every node has (name, location, ...), they don't change the exported material
+_BASE_PROPERTIES = {prop.identifier for prop in bpy.types.Node.bl_rna.properties}
+
+
+def calc_structure_hash(material):
+    """
+    Hash of everything that ends up in the exported material: the node types and their properties,
+    the unlinked socket values, the links and the referenced datablocks (images, volumes).
+    Copies of a material (e.g. "Wood.001" and "Wood.002" from appended assets) have the same hash.
+    Returns None if the material has no node tree (see material.convert() for the fallback).
+    """
+    node_tree = material.luxcore.node_tree
+    if node_tree is None:
+        return None
+
+    h = hashlib.md5()
+    h.update(node_tree.bl_idname.encode())
+
+    # Node names are part of the links, copied node trees keep them
+    for node in sorted(node_tree.nodes, key=lambda node: node.name):
+        h.update(("%s:%s" % (node.name, node.bl_idname)).encode())
+        _hash_node_properties(h, node)
+
+        for socket in node.inputs:
+            h.update(("%s:%s:%s" % (socket.identifier, socket.enabled, socket.is_linked)).encode())
+            if not socket.is_linked and hasattr(socket, "default_value"):
+                h.update(_to_string(socket.default_value).encode())
+
+    links = sorted((link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)
+                   for link in node_tree.links)
+    h.update(str(links).encode())
+
+    return h.hexdigest()
+
+
+def _hash_node_properties(h, node):
+    for prop in node.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier in _BASE_PROPERTIES:
+            continue
+
+        value = getattr(node, identifier)
+        if isinstance(value, bpy.types.ID):
+            value = utils.make_key(value)
+        h.update(("%s=%s" % (identifier, _to_string(value))).encode())
+
+
+def _to_string(value):
+    if hasattr(value, "__len__") and not isinstance(value, str):
+        value = tuple(value)
+    return str(value)
@@ -0,0 +1,126 @@
+import bpy
+from .. import utils
+from ..nodes.output import get_active_output
+
+
+class MaterialIndex(object):
+    """
+    Reverse indexes between node trees, materials and objects, so change detection and the
+    fallback node tree lookup only touch the affected entries instead of all materials and objects.
+    The indexes are rebuilt lazily when datablocks were added or removed, or after invalidate().
+    Re-assignments are applied to the affected entries with update_material(), update_tree() and update_objects().
+    """
+    def __init__(self):
+        self._signature = None
+        # Maps node tree key -> set of keys of materials using it (as node tree or as interior/exterior volume)
+        self._tree_materials = {}
+        # Maps material key -> keys of the node trees it was added to in _tree_materials
+        self._material_trees = {}
+        # Maps material key -> list of keys of objects that have it in their first material slot
+        self._material_objects = {}
+        # Maps object key -> key of the material in its first material slot
+        self._object_material = {}
+        # Maps key -> datablock name, to find the datablocks again
+        self._names = {}
+
+    def invalidate(self):
+        """ Call when the index can't be updated incrementally, it is rebuilt on the next use """
+        self._signature = None
+
+    def update_material(self, mat):
+        """ Call when the material was updated, its node tree might have been re-assigned """
+        mat_key = utils.make_key(mat)
+        self._remove_material(mat_key)
+        self._add_material(mat, mat_key)
+
+    def update_tree(self, node_tree):
+        """ Call when a material node tree was updated, volumes might have been (un)assigned in its output """
+        tree_key = utils.make_key(node_tree)
+        for mat_key in list(self._tree_materials.get(tree_key, ())):
+            mat = self.get_material(mat_key)
+            if mat and mat.luxcore.node_tree == node_tree:
+                self.update_material(mat)
+
+    def update_objects(self, objs):
+        """ Call for objects whose data changed, their material slots might have been re-assigned """
+        for obj in objs:
+            obj_key = utils.make_key(obj)
+            old_mat_key = self._object_material.pop(obj_key, None)
+            if old_mat_key:
+                self._material_objects[old_mat_key].remove(obj_key)
+            self._add_object(obj, obj_key)
+
+    def update(self):
+        signature = (len(bpy.data.materials), len(bpy.data.node_groups), len(bpy.data.objects))
+        if signature != self._signature:
+            self._rebuild()
+            self._signature = signature
+
+    def materials_using_tree(self, node_tree):
+        return self._tree_materials.get(utils.make_key(node_tree), set())
+
+    def objects_using_material(self, material):
+        """ Returns the objects that have the material in their first slot """
+        self.update()
+        objs = []
+        for key in self._material_objects.get(utils.make_key(material), []):
+            obj = self._resolve(bpy.data.objects, key)
+            if obj:
+                objs.append(obj)
+        return objs
+
+    def get_material(self, key):
+        return self._resolve(bpy.data.materials, key)
+
+    def _rebuild(self):
+        print("Rebuilding material index")
+        self._tree_materials = {}
+        self._material_trees = {}
+        self._material_objects = {}
+        self._object_material = {}
+        self._names = {}
+
+        for mat in bpy.data.materials:
+            self._add_material(mat, utils.make_key(mat))
+
+        for obj in bpy.data.objects:
+            self._add_object(obj, utils.make_key(obj))
+
+    def _add_material(self, mat, mat_key):
+        self._names[mat_key] = mat.name
+        node_tree = mat.luxcore.node_tree
+
+        if node_tree is None:
+            return
+
+        trees = [node_tree]
+        active_output = get_active_output(node_tree, "LuxCoreNodeMatOutput")
+        if active_output:
+            for volume in (active_output.interior_volume, active_output.exterior_volume):
+                if volume:
+                    trees.append(volume)
+
+        tree_keys = {utils.make_key(tree) for tree in trees}
+        self._material_trees[mat_key] = tree_keys
+        for tree_key in tree_keys:
+            self._tree_materials.setdefault(tree_key, set()).add(mat_key)
+
+    def _remove_material(self, mat_key):
+        for tree_key in self._material_trees.pop(mat_key, ()):
+            self._tree_materials[tree_key].discard(mat_key)
+
+    def _add_object(self, obj, obj_key):
+        if len(obj.material_slots) > 0 and obj.material_slots[0].material:
+            self._names[obj_key] = obj.name
+            mat_key = utils.make_key(obj.material_slots[0].material)
+            self._object_material[obj_key] = mat_key
+            self._material_objects.setdefault(mat_key, []).append(obj_key)
+
+    def _resolve(self, collection, key):
+        name = self._names.get(key)
+        datablock = collection.get(name) if name else None
+        if datablock and utils.make_key(datablock) == key:
+            return datablock
+        # Renamed, removed or a linked datablock with the same name as a local one
+        self.invalidate()
+        return utils.obj_from_key(key, collection)
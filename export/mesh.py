@@ -0,0 +1,581 @@
+import numpy as np
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+from time import time
+from ..bin import pyluxcore
+from .. import utils
+
+# The definition pool falls back to defining on the main thread if the workers
+# don't make the export at least this much faster (see DefinitionPool._check_speedup())
+MIN_POOL_SPEEDUP = 1.1
+# Number of finished definitions after which the speedup is measured
+POOL_SAMPLE_SIZE = 16
+# Concave polygons with more corners are fanned instead of ear clipped, which is too slow for them
+MAX_EAR_CLIP_CORNERS = 5000
+
+
+class MeshBuffers(object):
+    """
+    Contiguous, read-only buffers of one triangulated part of a mesh (all faces with the same material).
+    normals, uvs and colors are None if the mesh does not have them.
+    source_loops contains the Blender loop index of each vertex (None if unknown, e.g. loaded from disk).
+    """
+    __slots__ = ("vertices", "faces", "normals", "uvs", "colors", "source_loops")
+
+    def __init__(self, vertices, faces, normals=None, uvs=None, colors=None, source_loops=None):
+        self.vertices = vertices
+        self.faces = faces
+        self.normals = normals
+        self.uvs = uvs
+        self.colors = colors
+        self.source_loops = source_loops
+
+        for buffer in (vertices, faces, normals, uvs, colors, source_loops):
+            if buffer is not None:
+                buffer.flags.writeable = False
+
+    @property
+    def triangle_count(self):
+        return len(self.faces)
+
+
+def extract(mesh):
+    """
+    Bulk-read vertices, triangles, UVs, vertex colors and normals of a mesh with foreach_get.
+    There are no loops over single elements in Python, everything is done on NumPy arrays.
+    The mesh does not need tessfaces (to_mesh() can be called with calc_tessface=False).
+    Returns a list of (material_index, MeshBuffers) tuples, one for each used material index.
+    """
+    loop_count = len(mesh.loops)
+    poly_count = len(mesh.polygons)
+
+    coords = _read(mesh.vertices, "co", np.float32, 3)
+    loop_vertex_indices = _read(mesh.loops, "vertex_index", np.int32, 1)
+
+    # Per-loop attributes. Each unique combination of them becomes a LuxCore vertex.
+    loop_coords = coords[loop_vertex_indices]
+    loop_attributes = [loop_coords]
+
+    poly_smooth = _read(mesh.polygons, "use_smooth", np.int32, 1)
+    use_normals = bool(poly_smooth.any())
+    if use_normals:
+        # Split normals are the face normal for flat faces and respect custom normals
+        mesh.calc_normals_split()
+        loop_normals = _read(mesh.loops, "normal", np.float32, 3)
+        loop_attributes.append(loop_normals)
+
+    uv_layer = _find_active_uv_layer(mesh)
+    if uv_layer:
+        loop_attributes.append(_read(uv_layer.data, "uv", np.float32, 2))
+
+    vertex_color = mesh.vertex_colors.active
+    if vertex_color and loop_count:
+        color_size = len(vertex_color.data[0].color)
+        # LuxCore vertex colors are RGB
+        loop_attributes.append(_read(vertex_color.data, "color", np.float32, color_size)[:, :3])
+
+    # Only loops of the same Blender vertex may be merged, so the merged vertices stay valid
+    # when the mesh is deformed (see update_vertices()). The same goes for loops of flat faces,
+    # which have the face normal: they are never merged with loops of other faces.
+    if use_normals and not poly_smooth.all():
+        loop_totals = _read(mesh.polygons, "loop_total", np.int32, 1)
+        loop_polys = np.repeat(np.arange(poly_count, dtype=np.int32), loop_totals)
+        flat_loops = poly_smooth[loop_polys] == 0
+        loop_attributes.append(np.where(flat_loops, loop_polys, -1).astype(np.int32).view(np.float32)[:, None])
+    loop_attributes.append(loop_vertex_indices.view(np.float32)[:, None])
+
+    # Merge loops that share the same vertex and attributes
+    merged = np.ascontiguousarray(np.hstack(loop_attributes))
+    row_view = merged.view(np.dtype((np.void, merged.dtype.itemsize * merged.shape[1]))).ravel()
+    unique_rows, first_loops, loop_to_vertex = np.unique(row_view, return_index=True, return_inverse=True)
+    vertex_data = merged[first_loops]
+    del merged, row_view, unique_rows
+
+    triangles, triangle_materials = _triangulate(mesh, poly_count, loop_coords)
+    triangles = loop_to_vertex[triangles]
+
+    parts = []
+    for material_index in np.unique(triangle_materials):
+        part_triangles = triangles[triangle_materials == material_index]
+        # Only keep the vertices used by this part
+        used_vertices, part_faces = np.unique(part_triangles, return_inverse=True)
+        part_faces = part_faces.reshape(-1, 3).astype(np.uint32)
+        part_data = vertex_data[used_vertices]
+
+        column = 3
+        vertices = np.ascontiguousarray(part_data[:, :column])
+        normals = uvs = colors = None
+
+        if use_normals:
+            normals = np.ascontiguousarray(part_data[:, column:column + 3])
+            column += 3
+        if uv_layer:
+            uvs = np.ascontiguousarray(part_data[:, column:column + 2])
+            column += 2
+        if vertex_color and loop_count:
+            colors = np.ascontiguousarray(part_data[:, column:column + 3])
+
+        source_loops = first_loops[used_vertices].astype(np.int32)
+        buffers = MeshBuffers(vertices, part_faces, normals, uvs, colors, source_loops)
+        parts.append((int(material_index), buffers))
+
+    return parts
+
+
+class Topology(object):
+    """
+    Everything needed to tell if a mesh was only deformed (vertices moved) since it was extracted,
+    and to update the vertex positions and normals of the extracted parts in that case.
+    """
+    def __init__(self, mesh, parts):
+        self.vertex_count = len(mesh.vertices)
+        self.loop_vertex_indices = _read(mesh.loops, "vertex_index", np.int32, 1)
+        self.poly_materials = _read(mesh.polygons, "material_index", np.int32, 1)
+        self.poly_smooth = _read(mesh.polygons, "use_smooth", np.int32, 1)
+        # UVs and vertex colors decide which loops are merged, so they have to match, too
+        self.uvs, self.colors = _read_loop_layers(mesh)
+        self.parts = parts
+
+    @classmethod
+    def create(cls, mesh, parts):
+        """ Returns None if the parts can't be updated (they don't know their source loops) """
+        if any(buffers.source_loops is None for material_index, buffers in parts):
+            return None
+        return cls(mesh, parts)
+
+    def matches(self, mesh):
+        """ True if the mesh has the same topology, material assignment, UVs and vertex colors """
+        if len(mesh.vertices) != self.vertex_count:
+            return False
+        if len(mesh.loops) != len(self.loop_vertex_indices) or len(mesh.polygons) != len(self.poly_materials):
+            return False
+
+        if not (np.array_equal(_read(mesh.polygons, "material_index", np.int32, 1), self.poly_materials)
+                and np.array_equal(_read(mesh.polygons, "use_smooth", np.int32, 1), self.poly_smooth)
+                and np.array_equal(_read(mesh.loops, "vertex_index", np.int32, 1), self.loop_vertex_indices)):
+            return False
+
+        # UV edits and vertex painting
+        uvs, colors = _read_loop_layers(mesh)
+        return _optional_equal(uvs, self.uvs) and _optional_equal(colors, self.colors)
+
+
+def update_vertices(mesh, topology):
+    """
+    Fast path for deformed meshes (armature, shape keys, edit mode vertex moves):
+    Only the vertex positions and normals of the parts are read again,
+    triangulation and material split are re-used from the topology.
+    Check topology.matches(mesh) before calling this function.
+    Returns a list of (material_index, MeshBuffers) tuples, like extract().
+    """
+    coords = _read(mesh.vertices, "co", np.float32, 3)
+    loop_coords = coords[topology.loop_vertex_indices]
+
+    loop_normals = None
+    if any(buffers.normals is not None for material_index, buffers in topology.parts):
+        mesh.calc_normals_split()
+        loop_normals = _read(mesh.loops, "normal", np.float32, 3)
+
+    parts = []
+    for material_index, old_buffers in topology.parts:
+        source_loops = old_buffers.source_loops
+        vertices = loop_coords[source_loops]
+        normals = loop_normals[source_loops] if old_buffers.normals is not None else None
+        buffers = MeshBuffers(vertices, old_buffers.faces, normals, old_buffers.uvs, old_buffers.colors, source_loops)
+        parts.append((material_index, buffers))
+
+    return parts
+
+
+def define(luxcore_scene, shape_name, buffers, transformation=None):
+    """
+    Define a shape from MeshBuffers in the luxcore_scene.
+    The buffers are converted to lists of tuples in one go (no per-element Python code),
+    this is the data type expected by Scene.DefineMesh().
+    """
+    luxcore_scene.DefineMesh(shape_name,
+                             _to_tuples(buffers.vertices),
+                             _to_tuples(buffers.faces),
+                             _to_tuples(buffers.normals),
+                             _to_tuples(buffers.uvs),
+                             _to_tuples(buffers.colors),
+                             None,
+                             transformation)
+
+
+class DefinitionPool(object):
+    """
+    Defines shapes from MeshBuffers in a pool of worker threads, while the main thread
+    keeps extracting the next meshes (bpy must only be accessed from the main thread).
+    The shape names are chosen by the caller on the main thread, so the result does not
+    depend on the order in which the workers finish.
+
+    The workers only run concurrently with the main thread while one of them holds no GIL
+    (e.g. if pyluxcore releases it in DefineMesh(), or NumPy on the main thread does).
+    The pool measures the speedup it achieves from the CPU time of the main thread and the workers
+    and defines the remaining shapes on the main thread if it is too small, so it is never much
+    slower than no pool at all.
+    Shapes that can't be defined are reported and skipped, see filter_failed().
+    """
+    def __init__(self, luxcore_scene, worker_count):
+        self._luxcore_scene = luxcore_scene
+        self._executor = ThreadPoolExecutor(max_workers=worker_count)
+        # Limit the number of buffers waiting in memory
+        self._max_pending = worker_count * 4
+        self._pending = set()
+        self._shape_names = set()
+        # Names of the shapes that could not be defined, and of the LuxCore objects removed because of them
+        self.failed_shapes = set()
+        self.skipped_objects = set()
+        # We don't rely on the luxcore_scene being thread safe, only the
+        # conversion of the buffers runs concurrently
+        self._scene_lock = Lock()
+        # Measurement of the speedup: CPU time of the main thread and of the finished definitions
+        # in the workers, time the main thread waited for them, and the number of finished definitions.
+        # Only the CPU time of these threads counts, other threads (e.g. a viewport render) are left out.
+        self._start_time = time()
+        self._start_cpu_time = _thread_time()
+        self._worker_time = 0
+        self._wait_time = 0
+        self._finished_count = 0
+        self._synchronous = False
+
+    def submit(self, shape_name, buffers, transformation=None):
+        self._shape_names.add(shape_name)
+
+        if self._synchronous:
+            result, duration = self._define(shape_name, buffers, transformation)
+            self._add_result(result)
+            return
+
+        if len(self._pending) >= self._max_pending:
+            self._wait(FIRST_COMPLETED)
+            self._check_speedup()
+
+        future = self._executor.submit(self._define, shape_name, buffers, transformation)
+        self._pending.add(future)
+
+    def is_defined(self, shape_name):
+        """ True if the shape was submitted (it is guaranteed to be defined after finish()) """
+        return shape_name in self._shape_names
+
+    def wait_defined(self):
+        """ Wait until all shapes submitted so far are defined, the pool can still be used afterwards """
+        self._wait()
+
+    def finish(self):
+        """ Wait until all shapes are defined. Has to be called before objects using them are parsed. """
+        self.wait_defined()
+        self._executor.shutdown()
+        if self._finished_count:
+            speedup = self._speedup()
+            print("Definition pool: %d shapes, %.2fs CPU time in workers, main thread waited %.2fs, speedup %s"
+                  % (self._finished_count, self._worker_time, self._wait_time,
+                     "unknown" if speedup is None else "%.2f" % speedup))
+        if self.failed_shapes:
+            print("Definition pool: %d shape(s) could not be defined" % len(self.failed_shapes))
+
+    def filter_failed(self, props):
+        """
+        Returns props without the LuxCore objects (and subdivision shapes) using shapes that could not be defined,
+        like the synchronous export skips objects whose shapes fail. Call after wait_defined() or finish().
+        """
+        if not self.failed_shapes:
+            return props
+
+        names = props.GetAllNames()
+        failed_shapes = set(self.failed_shapes)
+        for name in names:
+            if name.startswith("scene.shapes.") and name.endswith(".source"):
+                if props.Get(name).GetString() in failed_shapes:
+                    failed_shapes.add(name[len("scene.shapes."):-len(".source")])
+
+        failed_prefixes = set()
+        for name in names:
+            if name.startswith("scene.objects.") and name.endswith(".shape"):
+                if props.Get(name).GetString() in failed_shapes:
+                    failed_prefixes.add(name[:-len("shape")])
+                    self.skipped_objects.add(name[len("scene.objects."):-len(".shape")])
+            elif name.startswith("scene.shapes.") and name.endswith(".source"):
+                if props.Get(name).GetString() in failed_shapes:
+                    failed_prefixes.add(name[:-len("source")])
+        if not failed_prefixes:
+            return props
+
+        failed_prefixes = tuple(failed_prefixes)
+        result = pyluxcore.Properties()
+        for name in names:
+            if not name.startswith(failed_prefixes):
+                result.Set(props.Get(name))
+        return result
+
+    def cancel(self):
+        """ Stop without defining the shapes that are still waiting """
+        for future in self._pending:
+            future.cancel()
+        self._executor.shutdown()
+        self._pending = set()
+
+    def _define(self, shape_name, buffers, transformation):
+        """ Returns (error or None, CPU time of this thread in seconds) """
+        start = _thread_time() or 0
+        try:
+            vertices = _to_tuples(buffers.vertices)
+            faces = _to_tuples(buffers.faces)
+            normals = _to_tuples(buffers.normals)
+            uvs = _to_tuples(buffers.uvs)
+            colors = _to_tuples(buffers.colors)
+
+            with self._scene_lock:
+                self._luxcore_scene.DefineMesh(shape_name, vertices, faces, normals, uvs, colors, None, transformation)
+        except Exception as error:
+            return (shape_name, error), (_thread_time() or 0) - start
+        return None, (_thread_time() or 0) - start
+
+    def _add_result(self, result):
+        if result is not None:
+            shape_name, error = result
+            print('ERROR: could not define shape "%s": %s' % (shape_name, error))
+            self.failed_shapes.add(shape_name)
+
+    def _wait(self, return_when=None):
+        start = time()
+        if return_when:
+            done, self._pending = wait(self._pending, return_when=return_when)
+        else:
+            done, self._pending = wait(self._pending)
+        self._wait_time += time() - start
+
+        for future in done:
+            result, duration = future.result()
+            self._worker_time += duration
+            self._finished_count += 1
+            self._add_result(result)
+
+    def _speedup(self):
+        """
+        CPU time of the main thread and the workers per wall clock time, None if it can't be measured.
+        Threads waiting for the GIL (or the main thread waiting for the workers) don't use CPU time,
+        so without any concurrency this is at most 1.
+        """
+        if self._start_cpu_time is None:
+            return None
+        elapsed = time() - self._start_time
+        if elapsed <= 0:
+            return 1
+        main_cpu_time = _thread_time() - self._start_cpu_time
+        return (main_cpu_time + self._worker_time) / elapsed
+
+    def _check_speedup(self):
+        if self._finished_count < POOL_SAMPLE_SIZE:
+            return
+        speedup = self._speedup()
+        if speedup is None:
+            print("Definition pool: the speedup can't be measured on this platform, "
+                  "defining the remaining shapes on the main thread")
+        elif speedup < MIN_POOL_SPEEDUP:
+            print("Definition pool: speedup %.2f is too small, defining the remaining shapes on the main thread"
+                  % speedup)
+        else:
+            return
+        self._wait()
+        self._synchronous = True
+
+
+def _thread_time():
+    """ CPU time of the calling thread in seconds, None if the platform does not support it """
+    if hasattr(time_module, "thread_time"):
+        # Python 3.7+
+        return time_module.thread_time()
+    if hasattr(time_module, "CLOCK_THREAD_CPUTIME_ID"):
+        return time_module.clock_gettime(time_module.CLOCK_THREAD_CPUTIME_ID)
+    return None
+
+
+def _read(collection, attr, dtype, size):
+    buffer = np.empty(len(collection) * size, dtype=dtype)
+    collection.foreach_get(attr, buffer)
+    if size > 1:
+        return buffer.reshape(-1, size)
+    return buffer
+
+
+def _read_loop_layers(mesh):
+    """ Returns the per-loop UVs and vertex colors used by extract(), None if the mesh has none """
+    uv_layer = _find_active_uv_layer(mesh)
+    uvs = _read(uv_layer.data, "uv", np.float32, 2) if uv_layer else None
+
+    colors = None
+    vertex_color = mesh.vertex_colors.active
+    if vertex_color and len(mesh.loops):
+        colors = _read(vertex_color.data, "color", np.float32, len(vertex_color.data[0].color))
+    return uvs, colors
+
+
+def _optional_equal(array1, array2):
+    if array1 is None or array2 is None:
+        return array1 is array2
+    return np.array_equal(array1, array2)
+
+
+def _find_active_uv_layer(mesh):
+    active_uv = utils.find_active_uv(mesh.uv_textures)
+    if active_uv:
+        return mesh.uv_layers.get(active_uv.name)
+    return None
+
+
+def _triangulate(mesh, poly_count, loop_coords):
+    """
+    Returns an (n, 3) array of loop indices and the material index of each triangle.
+    """
+    if hasattr(mesh, "loop_triangles"):
+        # Blender 2.8+
+        mesh.calc_loop_triangles()
+        triangles = _read(mesh.loop_triangles, "loops", np.int32, 3)
+        triangle_materials = _read(mesh.loop_triangles, "material_index", np.int32, 1)
+        return triangles, triangle_materials
+
+    loop_starts = _read(mesh.polygons, "loop_start", np.int32, 1)
+    loop_totals = _read(mesh.polygons, "loop_total", np.int32, 1)
+    poly_normals = _read(mesh.polygons, "normal", np.float32, 3)
+    poly_materials = _read(mesh.polygons, "material_index", np.int32, 1)
+
+    triangles, poly_of_triangle = triangulate_polygons(loop_coords, loop_starts, loop_totals, poly_normals)
+    return triangles, poly_materials[poly_of_triangle]
+
+
+def triangulate_polygons(loop_coords, loop_starts, loop_totals, poly_normals):
+    """
+    Triangles are fanned from the first loop of their polygon, which is only correct for convex polygons.
+    Concave polygons (found by their reflex corners) are triangulated by ear clipping instead.
+    Returns an (n, 3) array of loop indices and the polygon index of each triangle.
+    """
+    poly_count = len(loop_starts)
+    tris_per_poly = np.maximum(loop_totals - 2, 0)
+    concave = _find_concave_polygons(loop_coords, loop_starts, loop_totals, poly_normals)
+    tris_per_poly[concave] = 0
+
+    poly_of_triangle = np.repeat(np.arange(poly_count), tris_per_poly)
+    first_triangle_of_poly = np.cumsum(tris_per_poly) - tris_per_poly
+    index_in_poly = np.arange(len(poly_of_triangle)) - first_triangle_of_poly[poly_of_triangle]
+
+    starts = loop_starts[poly_of_triangle]
+    triangles = np.column_stack((starts, starts + index_in_poly + 1, starts + index_in_poly + 2))
+
+    concave_indices = np.flatnonzero(concave)
+    if len(concave_indices) == 0:
+        return triangles, poly_of_triangle
+
+    # Concave polygons are rare, they are handled one by one
+    ear_triangles = []
+    ear_polys = []
+    for poly_index in concave_indices:
+        start = loop_starts[poly_index]
+        corners = _ear_clip(loop_coords[start:start + loop_totals[poly_index]], poly_normals[poly_index])
+        ear_triangles.extend(corners)
+        ear_polys.extend([poly_index] * len(corners))
+
+    ear_triangles = np.array(ear_triangles, dtype=triangles.dtype).reshape(-1, 3) + loop_starts[ear_polys][:, None]
+    return (np.concatenate((triangles, ear_triangles)),
+            np.concatenate((poly_of_triangle, np.array(ear_polys, dtype=poly_of_triangle.dtype))))
+
+
+def _find_concave_polygons(loop_coords, loop_starts, loop_totals, poly_normals):
+    """ Returns a boolean array, True for polygons with at least one reflex corner """
+    loop_polys = np.repeat(np.arange(len(loop_starts)), loop_totals)
+    starts = loop_starts[loop_polys]
+    totals = loop_totals[loop_polys]
+    index_in_poly = np.arange(len(loop_polys)) - starts
+    prev_loops = starts + (index_in_poly - 1) % totals
+    next_loops = starts + (index_in_poly + 1) % totals
+
+    corner_normals = np.cross(loop_coords - loop_coords[prev_loops], loop_coords[next_loops] - loop_coords)
+    reflex = np.einsum("ij,ij->i", corner_normals, poly_normals[loop_polys]) < 0
+    # Triangles are always convex
+    reflex &= totals > 3
+    return np.bincount(loop_polys[reflex], minlength=len(loop_starts)) > 0
+
+
+def _ear_clip(coords, normal):
+    """
+    Triangulate one (possibly concave) polygon.
+    Returns a list of (i, j, k) corner indices with the winding order of the polygon.
+    """
+    count = len(coords)
+    if count > MAX_EAR_CLIP_CORNERS:
+        print("WARNING: Concave polygon with %d corners is too big for ear clipping, it is fanned" % count)
+        return [(0, j, j + 1) for j in range(1, count - 1)]
+
+    # Project the polygon onto the plane of its dominant normal axis, keeping the winding counter-clockwise
+    axis = int(np.argmax(np.abs(normal)))
+    u, v = (axis + 1) % 3, (axis + 2) % 3
+    if normal[axis] < 0:
+        u, v = v, u
+    points = np.asarray(coords, dtype=np.float64)[:, (u, v)]
+
+    # Doubly linked list of the remaining corners
+    prev_corners = [(i - 1) % count for i in range(count)]
+    next_corners = [(i + 1) % count for i in range(count)]
+    alive = np.ones(count, dtype=bool)
+    reflex = _cross(points[prev_corners], points, points[next_corners]) <= 0
+
+    def is_ear(i):
+        if reflex[i]:
+            return False
+        a, c = prev_corners[i], next_corners[i]
+        # Only reflex (or degenerate) corners can lie inside an ear, the neighbours are corners of the ear
+        others = reflex & alive
+        others[a] = others[c] = False
+        p = points[others]
+        return not ((_cross(points[a], points[i], p) >= 0)
+                    & (_cross(points[i], points[c], p) >= 0)
+                    & (_cross(points[c], points[a], p) >= 0)).any()
+
+    ears = [i for i in range(count) if is_ear(i)]
+    triangles = []
+    remaining = count
+
+    while remaining > 3:
+        # Clipping an ear only changes its neighbours, so ears found earlier might be outdated
+        while ears and not (alive[ears[-1]] and is_ear(ears[-1])):
+            ears.pop()
+        if not ears:
+            # No ear found (self-intersecting or degenerate polygon), fan the rest
+            first = int(np.flatnonzero(alive)[0])
+            corner = next_corners[first]
+            while next_corners[corner] != first:
+                triangles.append((first, corner, next_corners[corner]))
+                corner = next_corners[corner]
+            return triangles
+
+        i = ears.pop()
+        a, c = prev_corners[i], next_corners[i]
+        triangles.append((a, i, c))
+        alive[i] = False
+        next_corners[a] = c
+        prev_corners[c] = a
+        remaining -= 1
+
+        for corner in (a, c):
+            reflex[corner] = _cross(points[prev_corners[corner]], points[corner], points[next_corners[corner]]) <= 0
+            if is_ear(corner):
+                ears.append(corner)
+
+    a = int(np.flatnonzero(alive)[0])
+    triangles.append((a, next_corners[a], prev_corners[a]))
+    return triangles
+
+
+def _cross(a, b, c):
+    """ z component of the cross product of (b - a) and (c - a), for arrays of 2D points """
+    return (b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0])
+
+
+def _to_tuples(buffer):
+    # DefineMesh() only accepts Python lists. Each tuple of Python numbers costs about ten times
+    # the memory of the array row, so this is the memory peak of the buffer export.
+    if buffer is None:
+        return None
+    return list(map(tuple, buffer.tolist()))
@@ -0,0 +1,343 @@
+import array
+import hashlib
+import bpy
+from .. import utils
+from ..nodes import get_export_memo
+
+# Modifiers whose result depends on the current frame even if none of their settings change
+TIME_DEPENDENT_MODIFIERS = {
+    "CLOTH", "SOFT_BODY", "DYNAMIC_PAINT", "FLUID_SIMULATION", "SMOKE", "OCEAN", "WAVE",
+    "EXPLODE", "PARTICLE_SYSTEM", "PARTICLE_INSTANCE", "MESH_CACHE", "MESH_SEQUENCE_CACHE",
+}
+_ID_PROPERTIES = {prop.identifier for prop in bpy.types.ID.bl_rna.properties}
+
+
+def calc_fingerprint(blender_obj, scene, modifier_mode, skipped_modifier=None, mesh_cache=None):
+    """
+    Cheap content fingerprint of the mesh that blender_obj.to_mesh() would return.
+    It is computed from the base mesh data and the modifier stack, without evaluating the modifiers.
+
+    Returns a tuple (shape_key, fingerprint).
+    The shape_key identifies the mesh datablock/modifier combination, objects with the same
+    shape_key (e.g. linked duplicates) can share their shapes.
+    The fingerprint changes whenever the result of to_mesh() might change.
+    Returns (None, None) if the object can not be fingerprinted (e.g. not a mesh), in this case
+    the cache has to be bypassed. In edit mode, the fingerprint is None (the mesh has to be re-exported).
+    skipped_modifier is ignored, e.g. because it is not applied by Blender (LuxCore subdivision).
+    If a mesh_cache is passed, the fingerprint is None in viewport render when the state of the
+    referenced objects changed (e.g. while posing), the cached shapes can't be used in this case anyway.
+    """
+    mesh = blender_obj.data
+    if blender_obj.type != "MESH" or mesh is None:
+        return None, None
+
+    # State of referenced objects (transformation, pose) and the frame for time dependent modifiers.
+    # Objects with the same shape_key reference the same objects, so this is not part of the shape_key.
+    external_hash = hashlib.md5()
+    shape_key, references_objects, hashable, uses_vertex_groups = _hash_modifiers(
+        blender_obj, scene, modifier_mode, skipped_modifier, external_hash)
+
+    if blender_obj.mode == "EDIT":
+        # The mesh datablock is not synced with the edit mesh until edit mode is left
+        return shape_key, None
+
+    if not hashable:
+        # A referenced object or texture can change without changing the fingerprint
+        return shape_key, None
+
+    external_digest = external_hash.digest()
+    if (mesh_cache and modifier_mode == "PREVIEW"
+            and mesh_cache.external_state_changed(shape_key, external_digest)):
+        # Skip the expensive part below, the mesh has to be exported again anyway
+        return shape_key, None
+
+    if not references_objects:
+        # Linked duplicates have the same fingerprint, the base mesh is only hashed once per export
+        vertex_group_names = None
+        if uses_vertex_groups:
+            # The weights are stored in the mesh, but the group names belong to the object
+            vertex_group_names = tuple(group.name for group in blender_obj.vertex_groups)
+        memo_key = (shape_key, modifier_mode, external_digest, vertex_group_names)
+        fingerprints = get_export_memo("mesh_fingerprints")
+        if memo_key in fingerprints:
+            return shape_key, fingerprints[memo_key]
+
+    h = hashlib.md5()
+    # The fingerprint is also used as key of the persistent geometry cache,
+    # where viewport (PREVIEW) and final render (RENDER) meshes must not be mixed
+    h.update(modifier_mode.encode())
+    h.update(shape_key.encode())
+    h.update(external_digest)
+    h.update(str((len(mesh.vertices), len(mesh.edges), len(mesh.polygons), len(mesh.loops))).encode())
+    h.update(str((mesh.use_auto_smooth, mesh.auto_smooth_angle)).encode())
+    _hash_simplify_settings(h, scene)
+
+    _hash_collection(h, mesh.vertices, "co", "f", 3)
+    _hash_collection(h, mesh.vertices, "bevel_weight", "f", 1)
+    _hash_collection(h, mesh.edges, "vertices", "i", 2)
+    _hash_collection(h, mesh.edges, "crease", "f", 1)
+    _hash_collection(h, mesh.edges, "bevel_weight", "f", 1)
+    _hash_collection(h, mesh.loops, "vertex_index", "i", 1)
+    _hash_collection(h, mesh.polygons, "material_index", "i", 1)
+    _hash_collection(h, mesh.polygons, "use_smooth", "i", 1)
+
+    if mesh.has_custom_normals:
+        # calc_normals_split() writes into the mesh, use a temporary copy to leave the original untouched
+        normals_mesh = mesh.copy()
+        try:
+            normals_mesh.calc_normals_split()
+            _hash_collection(h, normals_mesh.loops, "normal", "f", 3)
+        finally:
+            bpy.data.meshes.remove(normals_mesh, do_unlink=False)
+
+    if mesh.shape_keys:
+        uses_vertex_groups |= any(key_block.vertex_group for key_block in mesh.shape_keys.key_blocks)
+
+    if uses_vertex_groups and len(blender_obj.vertex_groups) > 0:
+        # There is no bulk access to the weights in Blender 2.7x, so they are only hashed if they are used
+        h.update(str([vertex_group.name for vertex_group in blender_obj.vertex_groups]).encode())
+        weights = array.array("f", [group.weight for vertex in mesh.vertices for group in vertex.groups])
+        groups = array.array("i", [group.group for vertex in mesh.vertices for group in vertex.groups])
+        h.update(weights.tobytes())
+        h.update(groups.tobytes())
+
+    active_uv = mesh.uv_layers.active
+    if active_uv:
+        _hash_collection(h, active_uv.data, "uv", "f", 2)
+
+    vertex_color = mesh.vertex_colors.active
+    if vertex_color:
+        _hash_collection(h, vertex_color.data, "color", "f", 3)
+
+    if mesh.shape_keys:
+        h.update(str((mesh.shape_keys.use_relative, mesh.shape_keys.eval_time)).encode())
+        for key_block in mesh.shape_keys.key_blocks:
+            h.update(str((key_block.name, key_block.value, key_block.mute, key_block.relative_key.name,
+                          key_block.vertex_group, key_block.slider_min, key_block.slider_max)).encode())
+            _hash_collection(h, key_block.data, "co", "f", 3)
+
+    fingerprint = h.hexdigest()
+    if not references_objects:
+        fingerprints[memo_key] = fingerprint
+    return shape_key, fingerprint
+
+
+def calc_shape_key(blender_obj, scene, modifier_mode, skipped_modifier=None):
+    """ Only the shape_key of calc_fingerprint(), without hashing the mesh data. None if it is not a mesh. """
+    if blender_obj.type != "MESH" or blender_obj.data is None:
+        return None
+    return _hash_modifiers(blender_obj, scene, modifier_mode, skipped_modifier)[0]
+
+
+def _hash_modifiers(blender_obj, scene, modifier_mode, skipped_modifier, external_hash=None):
+    """
+    Returns a tuple (shape_key, references_objects, hashable, uses_vertex_groups), see calc_fingerprint().
+    The state of the referenced objects is only hashed if an external_hash is passed.
+    """
+    # Settings of the modifier stack, and the identity of objects referenced by it
+    modifiers_hash = hashlib.md5()
+    show_attr = "show_viewport" if modifier_mode == "PREVIEW" else "show_render"
+    references_objects = False
+    hashable = True
+    uses_vertex_groups = False
+
+    for modifier in blender_obj.modifiers:
+        if not getattr(modifier, show_attr) or modifier == skipped_modifier:
+            continue
+        modifiers_hash.update(modifier.type.encode())
+        modifier_references_objects, modifier_hashable = _hash_rna(modifiers_hash, external_hash, modifier)
+        references_objects |= modifier_references_objects
+        hashable &= modifier_hashable
+        uses_vertex_groups |= _uses_vertex_groups(modifier)
+
+        if modifier.type in TIME_DEPENDENT_MODIFIERS and external_hash is not None:
+            external_hash.update(str(scene.frame_current).encode())
+
+    if references_objects:
+        # The result of modifiers like Boolean, Armature, Array or Mirror depends on the transformation
+        # of this object relative to the referenced objects, so the shapes can't be shared
+        modifiers_hash.update(utils.make_key(blender_obj).encode())
+        if external_hash is not None:
+            external_hash.update(str(utils.matrix_to_list(blender_obj.matrix_world, None)).encode())
+
+    shape_key = utils.make_key(blender_obj.data) + "_" + modifiers_hash.hexdigest()[:8]
+    return shape_key, references_objects, hashable, uses_vertex_groups
+
+
+def _uses_vertex_groups(modifier):
+    if modifier.type == "ARMATURE":
+        return modifier.use_vertex_groups
+    # E.g. "vertex_group" of most modifiers, "vertex_group_a" of the Vertex Weight Mix modifier
+    return any(getattr(modifier, prop.identifier) for prop in modifier.bl_rna.properties
+               if prop.type == "STRING" and "vertex_group" in prop.identifier)
+
+
+def _hash_simplify_settings(h, scene):
+    """ The Simplify panel limits subdivision levels (and more) in viewport and final renders """
+    render = scene.render
+    for prop in render.bl_rna.properties:
+        if "simplify" in prop.identifier:
+            h.update(("%s=%s" % (prop.identifier, getattr(render, prop.identifier))).encode())
+
+
+def _hash_collection(h, collection, attr, typecode, size):
+    buffer = array.array(typecode, [0]) * (len(collection) * size)
+    collection.foreach_get(attr, buffer)
+    h.update(buffer.tobytes())
+
+
+def _hash_rna(h, external_hash, struct, skipped_properties=()):
+    """
+    Returns a tuple (references_objects, hashable).
+    hashable is False if a referenced datablock can change in a way that is not part of the hashes.
+    The state of referenced datablocks is hashed into external_hash, it can be None to skip this.
+    """
+    references_objects = False
+    hashable = True
+
+    for prop in struct.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier == "rna_type" or prop.type == "COLLECTION" or identifier in skipped_properties:
+            continue
+
+        value = getattr(struct, identifier, None)
+
+        if prop.type == "POINTER":
+            if isinstance(value, bpy.types.Object):
+                # Modifiers like Boolean, Array or Armature depend on other objects
+                references_objects = True
+                h.update(utils.make_key(value).encode())
+                if external_hash is not None:
+                    hashable &= _hash_referenced_object(external_hash, value)
+            elif isinstance(value, bpy.types.Texture):
+                # E.g. the Displace modifier
+                h.update(utils.make_key(value).encode())
+                if external_hash is not None:
+                    hashable &= _hash_texture(external_hash, value)
+            elif isinstance(value, bpy.types.ID):
+                h.update(utils.make_key(value).encode())
+            continue
+
+        if hasattr(value, "__len__") and not isinstance(value, str):
+            value = tuple(value)
+        h.update(("%s=%s" % (identifier, value)).encode())
+
+    return references_objects, hashable
+
+
+def _hash_referenced_object(h, obj):
+    """ Hash the state of an object used by a modifier, returns False if its geometry can't be hashed """
+    h.update(str(utils.matrix_to_list(obj.matrix_world, None)).encode())
+
+    if obj.type in {"EMPTY", "CAMERA", "LAMP"}:
+        # Only the transformation is used
+        return True
+    if obj.type == "ARMATURE":
+        for bone in obj.pose.bones:
+            h.update(str(utils.matrix_to_list(bone.matrix, None)).encode())
+        return True
+    if obj.type not in {"MESH", "LATTICE"}:
+        # Curves, surfaces, text and metaballs
+        return False
+    if obj.mode == "EDIT" or obj.data.shape_keys:
+        return False
+
+    if obj.type == "MESH":
+        if len(obj.modifiers) > 0:
+            # The modifiers are evaluated before the object is used (e.g. as Boolean cutter)
+            return False
+        mesh = obj.data
+        h.update(str((len(mesh.vertices), len(mesh.polygons), len(mesh.loops))).encode())
+        _hash_collection(h, mesh.vertices, "co", "f", 3)
+        _hash_collection(h, mesh.loops, "vertex_index", "i", 1)
+        return True
+
+    lattice = obj.data
+    h.update(str((lattice.points_u, lattice.points_v, lattice.points_w, lattice.interpolation_type_u,
+                  lattice.interpolation_type_v, lattice.interpolation_type_w, lattice.use_outside)).encode())
+    _hash_collection(h, lattice.points, "co_deform", "f", 3)
+    return True
+
+
+def _hash_texture(h, texture):
+    """ Hash the settings of a texture used by a modifier, returns False if its content can't be hashed """
+    if texture.use_nodes or texture.use_color_ramp or texture.type == "IMAGE":
+        # Node trees, color ramps and image pixels are not part of the texture settings
+        return False
+
+    # The ID properties (users, is_updated, ...) don't change the texture
+    references_objects, hashable = _hash_rna(h, h, texture, _ID_PROPERTIES)
+    return hashable
+
+
+class MeshCache(object):
+    """
+    Remembers the untransformed shapes that were defined in the luxcore_scene for each shape_key,
+    so unchanged meshes are not re-tessellated and re-defined on every export, and objects
+    using the same mesh datablock/modifier combination reference the same shapes.
+    One instance belongs to one Exporter (the shapes are only valid in its luxcore_scene).
+    """
+    def __init__(self):
+        # Maps shape_key -> (fingerprint, mesh_definitions, topology, mesh_size)
+        # mesh_definitions is the list returned by DefineBlenderMesh(): [(shape_name_part, material_index), ...]
+        # topology is a mesh.Topology instance or None, see mesh.update_vertices()
+        # mesh_size is the estimated memory of the shapes in bytes, see parked.estimate_mesh_size()
+        self._entries = {}
+        # Maps shape_key -> hash of the state of the objects referenced by the modifiers, see calc_fingerprint()
+        self._external_states = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, shape_key, mesh_fingerprint, luxcore_scene, definition_pool=None):
+        if mesh_fingerprint is None or shape_key not in self._entries:
+            self.misses += 1
+            return None
+
+        cached_fingerprint, mesh_definitions, topology, mesh_size = self._entries[shape_key]
+        if cached_fingerprint != mesh_fingerprint:
+            self.misses += 1
+            return None
+
+        # Make sure the shapes were not deleted from the scene in the meantime
+        for shape_name_part, material_index in mesh_definitions:
+            shape_name = "Mesh-" + shape_name_part
+            if definition_pool and definition_pool.is_defined(shape_name):
+                # Still being defined by a worker thread
+                continue
+            if not luxcore_scene.IsMeshDefined(shape_name):
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        return mesh_definitions
+
+    def set(self, shape_key, mesh_fingerprint, mesh_definitions, topology=None, mesh_size=0):
+        if shape_key is None:
+            return
+        self._entries[shape_key] = (mesh_fingerprint, mesh_definitions, topology, mesh_size)
+
+    def external_state_changed(self, shape_key, external_digest):
+        """ Returns True if the external state is different from the one of the last call for this shape_key """
+        old_digest = self._external_states.get(shape_key)
+        self._external_states[shape_key] = external_digest
+        return old_digest is not None and old_digest != external_digest
+
+    def has(self, shape_key):
+        return shape_key in self._entries
+
+    def remove_undefined(self, luxcore_scene):
+        """ Forget the entries whose shapes were deleted from the luxcore_scene """
+        for shape_key, (fingerprint, mesh_definitions, topology, mesh_size) in list(self._entries.items()):
+            if not all(luxcore_scene.IsMeshDefined("Mesh-" + shape_name_part)
+                       for shape_name_part, material_index in mesh_definitions):
+                del self._entries[shape_key]
+
+    def get_topology(self, shape_key):
+        if shape_key not in self._entries:
+            return None
+        return self._entries[shape_key][2]
+
+    def get_mesh_size(self, shape_key):
+        if shape_key not in self._entries:
+            return 0
+        return self._entries[shape_key][3]
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from ..utils import ExportedObject
+
+# Rough number of bytes LuxCore needs per mesh element (position, normal and uv per vertex, indices per triangle)
+BYTES_PER_VERTEX = 32
+BYTES_PER_TRIANGLE = 12
+
+
+class ParkedObjects(object):
+    """
+    Objects that were hidden in the viewport (e.g. by switching layers).
+    Their LuxCore objects are deleted, but the shapes are kept in the luxcore_scene,
+    so unhiding them only has to re-create the scene.objects.* entries.
+    The estimated memory of the parked shapes is limited. When it is exceeded, the objects that
+    were hidden first are dropped until the rest fits, but LuxCore can only free the shapes of all
+    parked objects at once (see enforce_limit()), so in effect all of them have to be converted again.
+    """
+    def __init__(self, max_size):
+        """
+        :param max_size: memory limit in bytes
+        """
+        self.max_size = max_size
+        # Maps object key -> (ExportedObject, estimated size in bytes), oldest first
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def park(self, key, exported_obj):
+        """
+        Returns True if the object was parked. The caller has to delete its LuxCore objects in any case.
+        """
+        if not isinstance(exported_obj, ExportedObject) or exported_obj.shape_names is None:
+            # Lights and other cheap objects are converted again
+            return False
+
+        self.discard(key)
+        size = exported_obj.mesh_size
+        self._entries[key] = (exported_obj, size)
+        self._size += size
+        return True
+
+    def unpark(self, key, luxcore_scene):
+        """
+        Returns the ExportedObject of the parked object, or None if it has to be converted again.
+        """
+        if key not in self._entries:
+            return None
+
+        exported_obj, size = self._entries.pop(key)
+        self._size -= size
+
+        for shape_name in exported_obj.shape_names:
+            if not luxcore_scene.IsMeshDefined(shape_name):
+                return None
+        return exported_obj
+
+    def discard(self, key):
+        """ Forget a parked object, e.g. because its mesh changed while it was hidden """
+        if key in self._entries:
+            exported_obj, size = self._entries.pop(key)
+            self._size -= size
+
+    def enforce_limit(self, luxcore_scene, mesh_cache):
+        """
+        Drop the oldest parked objects until the memory limit is met.
+        Has to be called during a scene edit, after the new objects were parsed.
+        """
+        if self._size <= self.max_size:
+            return
+
+        while self._entries and self._size > self.max_size:
+            key, (exported_obj, size) = self._entries.popitem(last=False)
+            self._size -= size
+            print("Dropping parked object:", key)
+
+        # LuxCore can only delete all meshes that are not referenced by an object at once.
+        # This includes the shapes of the remaining parked objects, they are converted again
+        # when they are unhidden (unpark() checks if the shapes still exist).
+        luxcore_scene.RemoveUnusedMeshes()
+        mesh_cache.remove_undefined(luxcore_scene)
+
+        for key in [key for key, (exported_obj, size) in self._entries.items()
+                    if not all(luxcore_scene.IsMeshDefined(name) for name in exported_obj.shape_names)]:
+            self.discard(key)
+
+
+def estimate_mesh_size(vertex_count, triangle_count):
+    """ Estimated memory of a shape in LuxCore in bytes """
+    return vertex_count * BYTES_PER_VERTEX + triangle_count * BYTES_PER_TRIANGLE
@@ -0,0 +1,85 @@
+from time import time
+
+# Export phases and their share of the progress bar
+SCENE_PHASES = (
+    ("Camera", 0.01),
+    ("Objects", 0.85),
+    ("Lights", 0.05),
+    ("World", 0.01),
+    ("Config", 0.08),
+)
+# Phases of the update between two frames of an animation, see Exporter.create_session_for_next_frame()
+NEXT_FRAME_PHASES = (
+    ("Camera", 0.01),
+    ("Objects", 0.80),
+    ("Materials", 0.10),
+    ("World", 0.01),
+    ("Config", 0.08),
+)
+# Minimum time between two progress reports in seconds, RenderEngine.update_stats() is not free
+REPORT_INTERVAL = 0.1
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportProgress(object):
+    """
+    Reports the progress of the export phases to the RenderEngine and checks if the user cancelled.
+    Without engine (e.g. viewport render), nothing is reported and the export can't be cancelled.
+    """
+    def __init__(self, engine=None, phases=SCENE_PHASES):
+        self.engine = engine
+        self._phase_weights = dict(phases)
+        self.phase = None
+        self.done = 0
+        self.total = 0
+        self._finished_weight = 0
+        self._phase_weight = 0
+        self._last_report = 0
+        # Maps phase name -> number of exported items, printed at the end
+        self.counts = {}
+
+    def start_phase(self, name, total=1):
+        if self.phase:
+            self._finished_weight += self._phase_weight
+        self.phase = name
+        self.done = 0
+        self.total = total
+        self._phase_weight = self._phase_weights[name]
+        self.counts[name] = 0
+        self._report(force=True)
+        self.check_cancel()
+
+    def step(self, exported=True):
+        """
+        Call after each item of the current phase.
+        Raises ExportCancelled if the user cancelled the render.
+        """
+        self.done += 1
+        if exported:
+            self.counts[self.phase] += 1
+        self._report()
+        self.check_cancel()
+
+    def check_cancel(self):
+        if self.engine and self.engine.test_break():
+            raise ExportCancelled("Export cancelled during phase %s (%d/%d)" % (self.phase, self.done, self.total))
+
+    def finish(self):
+        if self.engine:
+            self.engine.update_progress(1)
+        print("Export counts:", ", ".join("%s: %d" % (name, count) for name, count in self.counts.items()))
+
+    def _report(self, force=False):
+        if self.engine is None:
+            return
+        now = time()
+        if not force and now - self._last_report < REPORT_INTERVAL:
+            return
+        self._last_report = now
+
+        phase_fraction = self.done / self.total if self.total else 1
+        self.engine.update_progress(self._finished_weight + self._phase_weight * phase_fraction)
+        self.engine.update_stats("Export", "%s: %d/%d" % (self.phase, self.done, self.total))
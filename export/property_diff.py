@@ -0,0 +1,55 @@
+from ..bin import pyluxcore
+
+# Entities that are compared with their last sent definition. Shapes are left out because
+# the mesh cache already decides when they are defined, and LuxCore can remove them on its own
+# (RemoveUnusedMeshes), the camera is diffed by the camera cache.
+DIFFED_PREFIXES = (
+    "scene.textures.",
+    "scene.volumes.",
+    "scene.materials.",
+    "scene.objects.",
+    "scene.lights.",
+)
+
+
+class PropertyDiff(object):
+    """
+    Remembers the properties that were sent to the luxcore_scene during viewport scene edits, per entity
+    (e.g. "scene.materials.<name>"), so entities with an identical definition are not parsed again.
+    Setting one property of an entity resets the others, so a changed entity is always sent in full.
+    """
+    def __init__(self):
+        # Maps entity prefix -> {property name: values string}
+        self._sent = {}
+        self.skipped = 0
+        self.sent = 0
+
+    def filter(self, props):
+        """ Returns new Properties without the entities that did not change since they were last sent """
+        entities = {}
+        result = pyluxcore.Properties()
+
+        for name in props.GetAllNames():
+            if name.startswith(DIFFED_PREFIXES):
+                entity = ".".join(name.split(".", 3)[:3])
+                entities.setdefault(entity, {})[name] = props.Get(name).GetValuesString()
+            else:
+                result.Set(props.Get(name))
+
+        for entity, definition in entities.items():
+            if self._sent.get(entity) == definition:
+                self.skipped += 1
+                continue
+
+            self.sent += 1
+            self._sent[entity] = definition
+            result.Set(props.GetAllProperties(entity + "."))
+
+        return result
+
+    def forget(self, prefix, luxcore_name):
+        """ Call after an entity was deleted from the luxcore_scene, so it is sent again when it is re-defined """
+        self._sent.pop(prefix + luxcore_name, None)
+
+    def print_stats(self):
+        print("Property diff: %d entities sent, %d unchanged entities skipped" % (self.sent, self.skipped))
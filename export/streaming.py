@@ -0,0 +1,30 @@
+from mathutils import Matrix
+
+# Objects behind the viewer are not visible at first, but they might be after a small rotation
+BEHIND_VIEWER_FACTOR = 0.1
+
+
+def sort_by_priority(objs, context):
+    """
+    Sort the objects for progressive viewport export, the objects that cover most of the screen first.
+    """
+    view_matrix = Matrix(context.region_data.view_matrix).inverted()
+    view_location = view_matrix.to_translation()
+    view_direction = -view_matrix.col[2].xyz
+
+    def priority(obj):
+        return _screen_coverage(obj, view_location, view_direction)
+
+    return sorted(objs, key=priority, reverse=True)
+
+
+def _screen_coverage(obj, view_location, view_direction):
+    """ Rough estimate of the solid angle of the object's bounding sphere """
+    radius = max(obj.dimensions) / 2
+    offset = obj.matrix_world.to_translation() - view_location
+    distance = max(offset.length, 1e-3)
+
+    coverage = (radius / distance) ** 2
+    if offset.dot(view_direction) < -radius:
+        coverage *= BEHIND_VIEWER_FACTOR
+    return coverage
@@ -1,4 +1,6 @@
 import bpy
+import functools
+import threading
 from bpy.types import Node
 from .. import utils
 
@@ -8,6 +10,121 @@ TREE_TYPES = (
     "luxcore_volume_nodes",
 )
 
+# The export memo of the current thread, see ExportMemo
+_memo_state = threading.local()
+# Marks nodes that are currently being exported (to detect cycles)
+_IN_PROGRESS = object()
+# The recording of the material template that is currently compiled in this thread, see template.py
+_template_state = threading.local()
+
+
+class ExportMemo(object):
+    """
+    Context manager that remembers the exported nodes while it is active,
+    so a node linked to multiple sockets (or used by multiple materials) is only exported once.
+    Nested memos re-use the outermost one.
+    """
+    def __enter__(self):
+        self._is_outermost = getattr(_memo_state, "memo", None) is None
+        if self._is_outermost:
+            # Maps (node pointer, output socket identifier, luxcore_name) -> exported luxcore_name
+            _memo_state.memo = {}
+            # Keys of definitions that are shared by content, see define_once()
+            _memo_state.shared = set()
+            _memo_state.folded = 0
+            # Other things that only have to be computed once per export, see get_export_memo()
+            _memo_state.named = {}
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._is_outermost:
+            _memo_state.memo = None
+            _memo_state.named = None
+            if _memo_state.folded:
+                print("Shared definitions: %d duplicates folded" % _memo_state.folded)
+
+
+def with_export_memo(func):
+    """ Decorator for export functions, all nodes exported during the call share one ExportMemo """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with ExportMemo():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def export_linked_node(node, output, props, luxcore_name=None):
+    """
+    Export the node that is linked to an input socket, or return the name it was already exported with.
+    Returns None if the node is part of a cycle.
+    """
+    with ExportMemo():
+        memo = _memo_state.memo
+        key = (node.as_pointer(), output.identifier, luxcore_name)
+
+        if key in memo:
+            result = memo[key]
+            if result is _IN_PROGRESS:
+                print('ERROR: cycle in node tree "%s" at node "%s"' % (node.id_data.name, node.name))
+                return None
+            return result
+
+        memo[key] = _IN_PROGRESS
+        try:
+            if luxcore_name:
+                result = node.export(props, luxcore_name)
+            else:
+                result = node.export(props)
+        except Exception:
+            del memo[key]
+            raise
+
+        memo[key] = result
+        return result
+
+
+def get_export_memo(name):
+    """
+    Returns a dict that is kept while the outermost ExportMemo is active, for results that don't
+    change during one export (e.g. mesh fingerprints). Outside of an ExportMemo, the dict is empty and not kept.
+    """
+    if getattr(_memo_state, "memo", None) is None:
+        return {}
+    return _memo_state.named.setdefault(name, {})
+
+
+def define_once(key):
+    """
+    Returns True if the definition with this key has to be exported, i.e. it was not exported yet
+    in the current ExportMemo or a material template is compiled (the template has to contain it).
+    For definitions that are shared by content instead of by node (e.g. imagemaps of the same file).
+    """
+    with ExportMemo():
+        if key in _memo_state.shared:
+            _memo_state.folded += 1
+            return getattr(_template_state, "recording", None) is not None
+        _memo_state.shared.add(key)
+        return True
+
+
+def record_socket_value(socket, value):
+    """ Sockets call this with their exported default value, so it can become a slot of a material template """
+    recording = getattr(_template_state, "recording", None)
+    if recording is not None:
+        recording.add_socket(socket, value)
+    return value
+
+
+def use_as_key(value):
+    """
+    Call for socket values that are part of a LuxCore name. They become structural in a material
+    template, because patching the value would change the definition of a shared name.
+    """
+    recording = getattr(_template_state, "recording", None)
+    if recording is not None:
+        recording.discard_value(value)
+    return value
+
 
 class LuxCoreNode(Node):
     """Base class for LuxCore nodes (material, volume and texture)"""
@@ -38,6 +155,10 @@ class LuxCoreNode(Node):
 
         prefix = self.prefix + luxcore_name + "."
         props.Set(utils.create_props(prefix, definitions))
+
+        recording = getattr(_template_state, "recording", None)
+        if recording is not None:
+            recording.add_definitions(prefix, definitions)
         return luxcore_name
 
 
@@ -3,6 +3,8 @@ from bpy.types import NodeTree
 import nodeitems_utils
 from nodeitems_utils import NodeCategory, NodeItem, NodeItemCustom
 from ...ui import ICON_MATERIAL
+from ..output import invalidate_output_cache
+from ..template import invalidate_templates
 
 # Import all material nodes just so they get registered
 from .emission import LuxCoreNodeMatEmission
@@ -47,6 +49,8 @@ class LuxCoreMaterialNodeTree(NodeTree):
 
     # This block updates the preview, when socket links change
     def update(self):
+        invalidate_output_cache(self)
+        invalidate_templates(self)
         self.refresh = True
 
     def acknowledge_connection(self, context):
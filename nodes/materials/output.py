@@ -3,6 +3,7 @@ from ...bin import pyluxcore
 from ... import utils
 from bpy.props import BoolProperty, PointerProperty
 from ..output import LuxCoreNodeOutput, update_active, get_active_output
+from ..template import export_with_template
 
 
 class LuxCoreNodeMatOutput(LuxCoreNodeOutput):
@@ -60,34 +61,39 @@ class LuxCoreNodeMatOutput(LuxCoreNodeOutput):
         if exterior_volume and exterior_volume.bl_idname != "luxcore_volume_nodes":
             layout.label("Not a volume node tree!", icon="ERROR")
 
-    def export(self, props, luxcore_name):
+    def export(self, props, luxcore_name, exported_volumes=None):
         # We have to export volumes before the material definition because LuxCore properties
         # do not support forward declarations (the volume has to be already defined when it is
         # referenced in the material)
         # TODO: default exterior/interior volume
-        # TODO: cache volume export (can be slow in case of smoke. But maybe a smoke cache is enough or even better?)
         prefix = "scene.materials." + luxcore_name + "."
-        self._convert_volume(self.interior_volume, props, prefix + "volume.interior")
-        self._convert_volume(self.exterior_volume, props, prefix + "volume.exterior")
+        self._convert_volume(self.interior_volume, props, prefix + "volume.interior", exported_volumes)
+        self._convert_volume(self.exterior_volume, props, prefix + "volume.exterior", exported_volumes)
 
-        exported_name = self.inputs["Material"].export(props, luxcore_name)
+        exported_name = export_with_template(self.id_data, self.inputs["Material"], props, luxcore_name)
         if exported_name is None or exported_name != luxcore_name:
             # Export failed, e.g. because no node is linked or it's not a material node
             # Define a black material that signals an unconnected material socket
             self._convert_fallback(props, luxcore_name)
 
-    def _convert_volume(self, node_tree, props, property_str):
+    def _convert_volume(self, node_tree, props, property_str, exported_volumes=None):
         """
         property_str should be of the form
         "scene.materials.<luxcore_name>.volume.<interior/exterior>"
+        If the volume key is in the exported_volumes set, the volume is only referenced.
         """
         if node_tree is None:
             return
 
         try:
-            active_output = get_active_output(node_tree, "LuxCoreNodeVolOutput")
             luxcore_name = utils.get_unique_luxcore_name(node_tree)
-            active_output.export(props, luxcore_name)
+            key = utils.make_key(node_tree)
+
+            if exported_volumes is None or key not in exported_volumes:
+                active_output = get_active_output(node_tree, "LuxCoreNodeVolOutput")
+                active_output.export(props, luxcore_name)
+                if exported_volumes is not None:
+                    exported_volumes.add(key)
 
             props.Set(pyluxcore.Property(property_str, luxcore_name))
         except Exception as error:
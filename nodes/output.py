@@ -4,14 +4,26 @@ from . import LuxCoreNode
 from ..bin import pyluxcore
 
 
+# Maps node tree pointer -> (node count, output type, output node names, active output node name or None)
+# Invalidated by the update() callback of the node trees and when the active output changes
+_output_cache = {}
+
+
 def get_active_output(node_tree, output_type):
     assert output_type in ("LuxCoreNodeMatOutput", "LuxCoreNodeTexOutput", "LuxCoreNodeVolOutput")
 
-    for node in node_tree.nodes:
-        node_type = getattr(node, "bl_idname", None)
+    output_names, active_name = _get_cached_outputs(node_tree, output_type)
+    if active_name is None:
+        return None
 
-        if node_type == output_type and node.active:
-            return node
+    node = node_tree.nodes.get(active_name)
+    if node and node.bl_idname == output_type and node.active:
+        return node
+
+    # The cache is outdated (e.g. the node was renamed)
+    invalidate_output_cache(node_tree)
+    output_names, active_name = _get_cached_outputs(node_tree, output_type)
+    return node_tree.nodes[active_name] if active_name else None
 
 
 def get_output_nodes(node_tree):
@@ -24,15 +36,44 @@ def get_output_nodes(node_tree):
     else:
         raise NotImplementedError("Unkown node tree type %s" % node_tree.bl_idname)
 
-    nodes = []
+    output_names, active_name = _get_cached_outputs(node_tree, output_type)
+    nodes = [node_tree.nodes.get(name) for name in output_names]
 
-    for node in node_tree.nodes:
-        node_type = getattr(node, "bl_idname", None)
-        if node_type == output_type:
-            nodes.append(node)
+    if None in nodes:
+        invalidate_output_cache(node_tree)
+        output_names, active_name = _get_cached_outputs(node_tree, output_type)
+        nodes = [node_tree.nodes[name] for name in output_names]
     return nodes
 
 
+def invalidate_output_cache(node_tree):
+    _output_cache.pop(node_tree.as_pointer(), None)
+
+
+def _get_cached_outputs(node_tree, output_type):
+    """ Returns the names of all output nodes of output_type and the name of the active one """
+    key = node_tree.as_pointer()
+    node_count = len(node_tree.nodes)
+    cached = _output_cache.get(key)
+
+    # The node count catches added and deleted nodes even if the update() callback was not called
+    if cached is None or cached[0] != node_count or cached[1] != output_type:
+        output_names = []
+        active_name = None
+
+        for node in node_tree.nodes:
+            node_type = getattr(node, "bl_idname", None)
+            if node_type == output_type:
+                output_names.append(node.name)
+                if active_name is None and node.active:
+                    active_name = node.name
+
+        cached = (node_count, output_type, output_names, active_name)
+        _output_cache[key] = cached
+
+    return cached[2], cached[3]
+
+
 def update_active(output_node, context):
     if not output_node.active:
         # enabled -> disabled is not allowed
@@ -61,6 +102,7 @@ class LuxCoreNodeOutput(LuxCoreNode):
 
     def copy(self, orig_node):
         orig_node["active"] = False
+        invalidate_output_cache(self.id_data)
 
     def free(self):
         if not self.active:
@@ -77,6 +119,8 @@ class LuxCoreNodeOutput(LuxCoreNode):
             # we don't need to check the others
             break
 
+        invalidate_output_cache(node_tree)
+
     def export(self, props, luxcore_name):
         raise NotImplementedError("Derived classes have to override this method!")
 
@@ -93,3 +137,5 @@ class LuxCoreNodeOutput(LuxCoreNode):
                 # There can only be one active output at a time, so
                 # we don't need to check the others
                 break
+
+        invalidate_output_cache(node_tree)
@@ -3,6 +3,7 @@ import mathutils
 import bpy
 from bpy.types import NodeSocket
 from bpy.props import EnumProperty, FloatProperty, FloatVectorProperty
+from . import export_linked_node, record_socket_value
 
 # The rules for socket classes are these:
 # - If it is a socket that's used by more than one node, put it in this file
@@ -48,13 +49,10 @@ class LuxCoreNodeSocket(NodeSocket):
 
     def export(self, props, luxcore_name=None):
         if self.is_linked:
-            linked_node = self.links[0].from_node
-            if luxcore_name:
-                return linked_node.export(props, luxcore_name)
-            else:
-                return linked_node.export(props)
+            link = self.links[0]
+            return export_linked_node(link.from_node, link.from_socket, props, luxcore_name)
         elif hasattr(self, "default_value"):
-            return self.export_default()
+            return record_socket_value(self, self.export_default())
         else:
             return None
 
@@ -0,0 +1,164 @@
+import bpy
+from ..bin import pyluxcore
+from .. import utils
+from . import ExportMemo, _memo_state, _template_state
+
+# Maps (node tree pointer, luxcore_name) -> MaterialTemplate
+# Invalidated by the update() callback of the material node tree (links or nodes changed),
+# and cleared for each new session because pointers can be re-used by other node trees (e.g. after undo)
+_templates = {}
+# Properties every node has, they are not part of the node signature
+_BASE_PROPERTIES = {prop.identifier for prop in bpy.types.Node.bl_rna.properties}
+
+
+class MaterialTemplate(object):
+    """
+    The properties of an exported material node tree, with a slot for each unlinked socket value
+    that was used. If only socket values changed, the slots are patched instead of exporting the tree again.
+    """
+    def __init__(self, signature, props, result, slots):
+        self.signature = signature
+        self.props = props
+        # The luxcore_name returned by the export
+        self.result = result
+        # Maps (node name, socket identifier) -> [value, names of the properties containing the value]
+        self.slots = slots
+
+    def patch(self, node_tree):
+        """
+        Update the slots with the current socket values.
+        Returns False if the template has to be compiled again.
+        """
+        for (node_name, identifier), slot in self.slots.items():
+            socket = _find_input(node_tree, node_name, identifier)
+            if socket is None or socket.is_linked:
+                return False
+
+            value = socket.export_default()
+            if value == slot[0]:
+                continue
+
+            if not slot[1]:
+                # The value was not exported as it is (e.g. only used in a condition)
+                return False
+
+            for name in slot[1]:
+                self.props.Set(pyluxcore.Property(name, value))
+            slot[0] = value
+        return True
+
+
+class _Recording(object):
+    """ Collects the socket values and where they end up while a template is compiled """
+    def __init__(self):
+        self.slots = {}
+        # Maps id of an exported value -> slot key. The values are kept alive
+        # in self.slots, so their ids can't be re-used during the compilation
+        self._value_ids = {}
+
+    def add_socket(self, socket, value):
+        key = (socket.node.name, socket.identifier)
+        self.slots[key] = [value, []]
+        # Only floats and lists are new objects each time they are exported,
+        # other values (e.g. True or small ints) would be ambiguous
+        if isinstance(value, (float, list)):
+            self._value_ids[id(value)] = key
+
+    def discard_value(self, value):
+        self._value_ids.pop(id(value), None)
+
+    def add_definitions(self, prefix, definitions):
+        for name, value in definitions.items():
+            key = self._value_ids.get(id(value))
+            if key:
+                self.slots[key][1].append(prefix + name)
+
+
+def export_with_template(node_tree, socket, props, luxcore_name):
+    """
+    Export the node linked to the material socket of the output node, using the template of the node tree if possible.
+    Returns the luxcore_name of the exported material (or None, see LuxCoreNodeSocket.export).
+    """
+    key = (node_tree.as_pointer(), luxcore_name)
+    template = _templates.get(key)
+    signature = _get_signature(node_tree)
+
+    if template is None or template.signature != signature or not template.patch(node_tree):
+        template = _compile(node_tree, socket, luxcore_name, signature)
+        _templates[key] = template
+
+    props.Set(template.props)
+    return template.result
+
+
+def invalidate_templates(node_tree):
+    pointer = node_tree.as_pointer()
+    for key in [key for key in _templates if key[0] == pointer]:
+        del _templates[key]
+
+
+def clear_templates():
+    """ Call when a new session is created, this also drops the templates of removed node trees """
+    _templates.clear()
+
+
+def _compile(node_tree, socket, luxcore_name, signature):
+    print('Compiling material template of node tree "%s"' % node_tree.name)
+    recording = _Recording()
+    props = pyluxcore.Properties()
+
+    with ExportMemo():
+        # The template has to contain all nodes, even if they were already exported by another material
+        outer_memo = _memo_state.memo
+        _memo_state.memo = {}
+        _template_state.recording = recording
+
+        try:
+            result = socket.export(props, luxcore_name)
+        finally:
+            _template_state.recording = None
+            _memo_state.memo = outer_memo
+
+    return MaterialTemplate(signature, props, result, recording.slots)
+
+
+def _get_signature(node_tree):
+    """
+    The node properties that are not sockets (e.g. the image of an imagemap node) and the links.
+    Changing them does not always call the update() callback of the node tree, so they are compared on each use.
+    """
+    links = sorted((link.from_node.name, link.from_socket.identifier, link.to_node.name, link.to_socket.identifier)
+                   for link in node_tree.links)
+    return node_tree.name, [_get_node_signature(node) for node in node_tree.nodes], links
+
+
+def _get_node_signature(node):
+    values = [node.name, node.bl_idname]
+
+    for prop in node.bl_rna.properties:
+        if prop.identifier in _BASE_PROPERTIES:
+            continue
+
+        value = getattr(node, prop.identifier)
+        if isinstance(value, bpy.types.Image):
+            # The exported file path depends on these, not only on the datablock
+            value = (utils.make_key(value), bpy.path.abspath(value.filepath, library=value.library),
+                     value.source, bool(value.packed_file))
+        elif isinstance(value, bpy.types.ID):
+            value = utils.make_key(value)
+        elif hasattr(value, "__len__") and not isinstance(value, str):
+            value = tuple(value)
+        values.append(value)
+
+    return values
+
+
+def _find_input(node_tree, node_name, identifier):
+    node = node_tree.nodes.get(node_name)
+    if node is None:
+        return None
+
+    for socket in node.inputs:
+        if socket.identifier == identifier:
+            return socket
+    return None
@@ -1,6 +1,8 @@
 import bpy
+import hashlib
+import os
 from bpy.props import PointerProperty
-from .. import LuxCoreNodeTexture
+from .. import LuxCoreNodeTexture, define_once, use_as_key
 from ...export.image import ImageExporter
 from ... import utils
 
@@ -39,4 +41,18 @@ class LuxCoreNodeTexImagemap(LuxCoreNodeTexture):
             "gamma": self.inputs["Gamma"].export(props),
             "gain": self.inputs["Gain"].export(props),
         }
+
+        if luxcore_name is None:
+            # Imagemaps with the same file and settings share one LuxCore texture, even across materials
+            key = ("imagemap", definitions["file"], use_as_key(definitions["gamma"]), use_as_key(definitions["gain"]))
+            luxcore_name = _make_shared_name(key)
+            if not define_once(key):
+                return luxcore_name
+
         return self.base_export(props, definitions, luxcore_name)
+
+
+def _make_shared_name(key):
+    file_name = os.path.basename(key[1])
+    key_hash = hashlib.md5(str(key).encode()).hexdigest()[:8]
+    return utils.to_luxcore_name("%s_%s_tex" % (file_name, key_hash))
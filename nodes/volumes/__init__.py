@@ -3,6 +3,7 @@ from bpy.types import NodeTree
 import nodeitems_utils
 from nodeitems_utils import NodeCategory, NodeItem, NodeItemCustom
 from ...ui import ICON_VOLUME
+from ..output import invalidate_output_cache
 
 from .output import LuxCoreNodeVolOutput
 from .clear import LuxCoreNodeVolClear
@@ -37,6 +38,7 @@ class LuxCoreVolumeNodeTree(NodeTree):
 
     # This block updates the preview, when socket links change
     def update(self):
+        invalidate_output_cache(self)
         self.refresh = True
 
     def acknowledge_connection(self, context):
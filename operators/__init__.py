@@ -90,3 +90,17 @@ class LUXCORE_OT_material_new(bpy.types.Operator):
             obj.data.materials.append(mat)
 
         return {"FINISHED"}
+
+
+class LUXCORE_OT_clear_geometry_cache(bpy.types.Operator):
+    bl_idname = "luxcore.clear_geometry_cache"
+    bl_label = "Clear Geometry Cache"
+    bl_description = "Delete all meshes stored in the geometry cache directory"
+
+    def execute(self, context):
+        from ..export.geometry_cache import GeometryCache, default_directory
+        performance = context.scene.luxcore.performance
+        directory = bpy.path.abspath(performance.geometry_cache_dir) or default_directory()
+        count = GeometryCache(directory, 0).clear()
+        self.report({"INFO"}, "Deleted %d cached meshes" % count)
+        return {"FINISHED"}
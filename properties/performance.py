@@ -0,0 +1,121 @@
+import bpy
+from bpy.props import EnumProperty, IntProperty, BoolProperty, StringProperty
+
+
+MESH_EXPORT_MODE_DESCRIPTION = (
+    "How mesh data is handed from Blender to LuxCore. Buffers need more memory during the export, "
+    "because they are converted to Python lists for LuxCore"
+)
+
+DEFINITION_THREADS_DESCRIPTION = (
+    "Number of worker threads that define meshes in LuxCore while Blender extracts the next ones; "
+    "0 defines all meshes one after another (only used with buffer mesh export). Only faster if the threads "
+    "can run concurrently, otherwise the export falls back to one thread (the speedup is printed in the console)"
+)
+
+REUSE_SCENE_DESCRIPTION = (
+    "Keep the LuxCore scene between the frames of an animation render and only update "
+    "animated objects, materials, lights and the camera"
+)
+
+GEOMETRY_CACHE_DESCRIPTION = (
+    "Store exported meshes on disk and re-use them in later final renders if they did not change "
+    "(only used with buffer mesh export)"
+)
+
+GEOMETRY_CACHE_DIR_DESCRIPTION = "Where the geometry cache is stored; leave empty to use the temporary directory"
+
+LUXCORE_SUBDIVISION_DESCRIPTION = (
+    "Export the cage of a Subdivision Surface modifier at the end of the modifier stack and let LuxCore "
+    "subdivide it (saves export time and memory, the result differs slightly from Blender's subdivision)"
+)
+
+VIEWPORT_LOD_DESCRIPTION = (
+    "Show decimated proxies of meshes with many triangles in viewport render while the scene is edited, "
+    "the full meshes are shown when the viewport does not change for a moment (only used with buffer mesh export)"
+)
+
+PROGRESSIVE_EXPORT_DESCRIPTION = (
+    "Start viewport render after the lights and the objects that cover most of the screen are exported, "
+    "the other objects are added while rendering"
+)
+
+CHUNKED_PARSE_DESCRIPTION = (
+    "Hand the scene definitions to LuxCore in chunks while exporting, instead of collecting "
+    "the whole scene first (lowers the peak memory usage of big scenes)"
+)
+
+INSTANCING_THRESHOLD_DESCRIPTION = (
+    "In final renders, meshes used by at least this many objects are instanced, the transformation "
+    "of the other objects is baked into their meshes (1: instance everything)"
+)
+
+DEDUPLICATE_MATERIALS_DESCRIPTION = (
+    "In final renders, export materials with identical node trees (e.g. copies like Wood.001 "
+    "and Wood.002) only once and let all their objects use the same LuxCore material"
+)
+
+IMAGE_CACHE_DIR_DESCRIPTION = (
+    "Where packed and generated images are saved for LuxCore, they are re-used in later sessions; "
+    "leave empty to use the temporary directory"
+)
+
+PARKED_MEMORY_LIMIT_DESCRIPTION = (
+    "Estimated memory (MB) that the meshes of objects hidden during viewport render may use, "
+    "so unhiding them does not need a new export; when it is exceeded, the meshes of all hidden objects are freed"
+)
+
+
+class LuxCorePerformance(bpy.types.PropertyGroup):
+    """
+    Export performance settings.
+    Access (in ui or export) with scene.luxcore.performance
+    """
+    mesh_export_modes = [
+        ("BUFFERS", "Buffers", "Bulk-read the mesh into buffers (needed for the geometry cache, definition threads "
+                               "and viewport proxies). Needs much more memory on big meshes", 0),
+        ("TESSFACES", "Tessfaces", "Pass the tessellated faces to LuxCore by memory address (lowest memory use)", 1),
+    ]
+    mesh_export_mode = EnumProperty(name="Mesh Export", items=mesh_export_modes, default="TESSFACES",
+                                    description=MESH_EXPORT_MODE_DESCRIPTION)
+    use_luxcore_subdivision = BoolProperty(name="LuxCore Subdivision", default=False,
+                                           description=LUXCORE_SUBDIVISION_DESCRIPTION)
+    # Only used when the scene is exported from scratch, not during viewport updates
+    definition_threads = IntProperty(name="Definition Threads", default=0, min=0, soft_max=32,
+                                     description=DEFINITION_THREADS_DESCRIPTION)
+
+    instancing_threshold = IntProperty(name="Instancing Threshold", default=2, min=1, soft_max=100,
+                                       description=INSTANCING_THRESHOLD_DESCRIPTION)
+
+    use_chunked_parse = BoolProperty(name="Chunked Parse", default=False, description=CHUNKED_PARSE_DESCRIPTION)
+    parse_chunk_size = IntProperty(name="Chunk Size", default=10000, min=100, soft_max=1000000,
+                                   description="Number of properties that are collected before they are parsed")
+
+    use_geometry_cache = BoolProperty(name="Geometry Cache", default=False, description=GEOMETRY_CACHE_DESCRIPTION)
+    geometry_cache_dir = StringProperty(name="Directory", subtype="DIR_PATH",
+                                        description=GEOMETRY_CACHE_DIR_DESCRIPTION)
+    # When the cache gets bigger, the least recently used meshes are deleted
+    geometry_cache_size = IntProperty(name="Size Limit (MB)", default=4096, min=1, soft_max=65536)
+
+    image_cache_dir = StringProperty(name="Image Cache Directory", subtype="DIR_PATH",
+                                     description=IMAGE_CACHE_DIR_DESCRIPTION)
+    # When the cache gets bigger, the least recently used images are deleted
+    image_cache_size = IntProperty(name="Image Cache Size Limit (MB)", default=4096, min=1, soft_max=65536)
+
+    use_viewport_lod = BoolProperty(name="Viewport Proxies", default=False, description=VIEWPORT_LOD_DESCRIPTION)
+    viewport_lod_triangles = IntProperty(name="Max Triangles", default=100000, min=100, soft_max=10000000,
+                                         description="Triangle budget of each object in viewport render")
+
+    use_progressive_export = BoolProperty(name="Progressive Viewport Export", default=False,
+                                          description=PROGRESSIVE_EXPORT_DESCRIPTION)
+    progressive_batch_time = IntProperty(name="Batch Time (ms)", default=100, min=10, soft_max=2000,
+                                         description="Time spent exporting objects before the viewport is redrawn")
+
+    parked_memory_limit = IntProperty(name="Hidden Objects Memory (MB)", default=1024, min=0, soft_max=16384,
+                                      description=PARKED_MEMORY_LIMIT_DESCRIPTION)
+
+    deduplicate_materials = BoolProperty(name="Merge Identical Materials", default=True,
+                                         description=DEDUPLICATE_MATERIALS_DESCRIPTION)
+
+    reuse_scene_in_animation = BoolProperty(name="Re-use Scene in Animations", default=False,
+                                            description=REUSE_SCENE_DESCRIPTION)
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+# import the already loaded addon
+from BlendLuxCore.export.geometry_cache import GeometryCache
+from BlendLuxCore.export.mesh import MeshBuffers
+
+MB = 1024 * 1024
+
+
+def make_parts(vertex_count=4):
+    vertices = np.arange(vertex_count * 3, dtype=np.float32).reshape(-1, 3)
+    faces = np.array([(0, 1, 2), (0, 2, 3)], dtype=np.uint32)
+    uvs = np.linspace(0, 1, vertex_count * 2, dtype=np.float32).reshape(-1, 2)
+    return [(0, MeshBuffers(vertices, faces, uvs=uvs)),
+            (2, MeshBuffers(vertices[:3], faces[:1]))]
+
+
+class TestGeometryCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        parts = make_parts()
+        GeometryCache(self.directory, 16 * MB).save("fingerprint", parts)
+
+        # A new instance, like in the next Blender session
+        loaded = GeometryCache(self.directory, 16 * MB).load("fingerprint")
+
+        self.assertEqual(len(loaded), len(parts))
+        for (material_index, buffers), (loaded_index, loaded_buffers) in zip(parts, loaded):
+            self.assertEqual(material_index, loaded_index)
+            for name in ("vertices", "faces", "normals", "uvs", "colors"):
+                array = getattr(buffers, name)
+                loaded_array = getattr(loaded_buffers, name)
+                if array is None:
+                    self.assertIsNone(loaded_array)
+                else:
+                    self.assertEqual(array.dtype, loaded_array.dtype)
+                    self.assertTrue(np.array_equal(array, loaded_array), name)
+
+    def test_missing_fingerprint(self):
+        cache = GeometryCache(self.directory, 16 * MB)
+        self.assertIsNone(cache.load("unknown"))
+        self.assertIsNone(cache.load(None))
+        self.assertEqual(cache.misses, 2)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = GeometryCache(self.directory, 16 * MB)
+        cache.save("a", make_parts())
+        cache.save("b", make_parts())
+        entry_size = os.path.getsize(cache._path("a"))
+        # Use "a", so "b" is the least recently used entry
+        cache.load("a")
+
+        cache.max_size = entry_size * 2
+        cache.save("c", make_parts())
+
+        self.assertIsNotNone(cache.load("a"))
+        self.assertIsNone(cache.load("b"))
+        self.assertIsNotNone(cache.load("c"))
+        self.assertFalse(os.path.exists(cache._path("b")))
+
+
+# we have to manually invoke the test runner here, as we cannot use the CLI
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestGeometryCache)
+unittest.TextTestRunner().run(suite)
@@ -0,0 +1,55 @@
+import unittest
+import bpy
+import numpy as np
+
+# import the already loaded addon
+from BlendLuxCore.export import mesh
+
+# L-shaped hexagon (concave corner at index 3), counter-clockwise seen from +Z, area 3
+L_SHAPE = [(0, 0, 0), (2, 0, 0), (2, 1, 0), (1, 1, 0), (1, 2, 0), (0, 2, 0)]
+
+
+def signed_areas(vertices, faces):
+    edges1 = vertices[faces[:, 1]] - vertices[faces[:, 0]]
+    edges2 = vertices[faces[:, 2]] - vertices[faces[:, 0]]
+    return np.cross(edges1, edges2)[:, 2] / 2
+
+
+class TestTriangulation(unittest.TestCase):
+    def test_concave_polygon_any_start(self):
+        normals = np.array([(0, 0, 1)], dtype=np.float32)
+
+        for shift in range(len(L_SHAPE)):
+            coords = np.array(L_SHAPE[shift:] + L_SHAPE[:shift], dtype=np.float32)
+            triangles, polys = mesh.triangulate_polygons(coords, np.array([0]), np.array([6]), normals)
+            areas = signed_areas(coords, triangles)
+
+            self.assertEqual(len(triangles), 4)
+            self.assertTrue((areas > 0).all(), "Flipped triangle when starting at corner %d" % shift)
+            self.assertAlmostEqual(float(areas.sum()), 3)
+
+    def test_convex_polygons_are_fanned(self):
+        coords = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)], dtype=np.float32)
+        normals = np.array([(0, 0, 1)], dtype=np.float32)
+        triangles, polys = mesh.triangulate_polygons(coords, np.array([0]), np.array([4]), normals)
+        self.assertEqual(triangles.tolist(), [[0, 1, 2], [0, 2, 3]])
+
+    def test_extract_concave_mesh(self):
+        blender_mesh = bpy.data.meshes.new("concave")
+        blender_mesh.from_pydata(L_SHAPE, [], [list(range(6))])
+        blender_mesh.update()
+
+        parts = mesh.extract(blender_mesh)
+        self.assertEqual(len(parts), 1)
+        material_index, buffers = parts[0]
+        areas = signed_areas(buffers.vertices, buffers.faces.astype(np.int64))
+
+        self.assertEqual(buffers.triangle_count, 4)
+        self.assertTrue((areas > 0).all())
+        self.assertAlmostEqual(float(areas.sum()), 3, places=5)
+        bpy.data.meshes.remove(blender_mesh)
+
+
+# we have to manually invoke the test runner here, as we cannot use the CLI
+suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestTriangulation)
+unittest.TextTestRunner().run(suite)
@@ -0,0 +1,60 @@
+import bl_ui
+from bl_ui.properties_render import RenderButtonsPanel
+import bpy
+from bpy.types import Panel
+
+
+class LuxCorePerformance(RenderButtonsPanel, Panel):
+    COMPAT_ENGINES = "LUXCORE"
+    bl_label = "LuxCore Performance"
+    bl_options = {"DEFAULT_CLOSED"}
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.render.engine == "LUXCORE"
+
+    def draw(self, context):
+        layout = self.layout
+        performance = context.scene.luxcore.performance
+
+        layout.prop(performance, "mesh_export_mode")
+        layout.prop(performance, "use_luxcore_subdivision")
+
+        row = layout.row()
+        row.enabled = performance.mesh_export_mode == "BUFFERS"
+        row.prop(performance, "definition_threads")
+
+        layout.prop(performance, "instancing_threshold")
+        layout.prop(performance, "deduplicate_materials")
+        layout.prop(performance, "use_chunked_parse")
+        row = layout.row()
+        row.enabled = performance.use_chunked_parse
+        row.prop(performance, "parse_chunk_size")
+
+        col = layout.column()
+        col.enabled = performance.mesh_export_mode == "BUFFERS"
+        col.prop(performance, "use_geometry_cache")
+        sub = col.column()
+        sub.enabled = performance.use_geometry_cache
+        sub.prop(performance, "geometry_cache_dir")
+        sub.prop(performance, "geometry_cache_size")
+        sub.operator("luxcore.clear_geometry_cache")
+
+        col = layout.column()
+        col.prop(performance, "image_cache_dir")
+        col.prop(performance, "image_cache_size")
+
+        col = layout.column()
+        col.enabled = performance.mesh_export_mode == "BUFFERS"
+        col.prop(performance, "use_viewport_lod")
+        sub = col.column()
+        sub.enabled = performance.use_viewport_lod
+        sub.prop(performance, "viewport_lod_triangles")
+
+        layout.prop(performance, "use_progressive_export")
+        row = layout.row()
+        row.enabled = performance.use_progressive_export
+        row.prop(performance, "progressive_batch_time")
+
+        layout.prop(performance, "parked_memory_limit")
+        layout.prop(performance, "reuse_scene_in_animation")
@@ -4,10 +4,18 @@ from ..bin import pyluxcore
 
 
 class ExportedObject(object):
-    def __init__(self, luxcore_names):
+    def __init__(self, luxcore_names, shape_names=None, material_names=None, is_proxy=False, mesh_size=0):
         # Note that luxcore_names is a list of names (because an object in Blender can have multiple materials,
         # while in LuxCore it can have only one material, so we have to split it into multiple LuxCore objects)
         self.luxcore_names = luxcore_names
+        # Shape and material of each LuxCore object (same order as luxcore_names),
+        # needed to re-define the objects when only their transformation changed
+        self.shape_names = shape_names
+        self.material_names = material_names
+        # True if the shapes are decimated viewport proxies
+        self.is_proxy = is_proxy
+        # Estimated memory of the defined shapes in bytes, see export/parked.py
+        self.mesh_size = mesh_size
 
 
 class ExportedLight(object):